@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+from compressors import container, transforms
+from compressors.huffman import build_code_lengths
+from compressors.registry import get_codec
+
+# predicts which lossless codec compresses an image best from a few histograms,
+# without running the (slow, pure-Python) codecs themselves
+
+# choice offered next to the codec names in the GUI and the benchmark runner
+AUTO = "Auto"
+
+# codec configurations the advisor chooses between
+CANDIDATES = [
+    (name, params)
+    for name in ("Huffman", "LZW", "DEFLATE")
+    for params in ({}, {"color_transform": "ycocg-r", "predictor": "med"})
+]
+
+# images with more pixels are analysed on a strided sample of row bands,
+# bands keep the left and upper neighbours the statistics and predictors look at
+SAMPLE_PIXELS = 1 << 16
+BAND_ROWS = 16
+
+# statistics per channel, each the mean over the three channels
+FEATURES = ["entropy", "conditional_entropy", "repeats", "mean_run", "huffman_bits"]
+
+# compressed bits per input byte = coefficients . (entropy, conditional_entropy, repeats, huffman_bits, 1),
+# fitted by least squares on test_images/ with every candidate configuration (python advisor.py checks them)
+SIZE_MODELS = {
+    "Huffman": (0.0, 0.0, 0.0, 0.995, 0.0),
+    "LZW": (0.463, 1.055, 1.483, 0.0, -1.428),
+    "DEFLATE": (0.489, 0.580, 0.0, 0.0, 0.109),
+}
+
+# encode time in microseconds per input byte = a + b * compressed bits per byte,
+# measured single-threaded on the same images; only the ratios between codecs carry over to other machines
+TIME_MODELS = {
+    "Huffman": (0.077, 0.005),
+    "LZW": (0.183, 0.021),
+    "DEFLATE": (0.080, 0.0),
+}
+
+# Shannon entropy in bits per symbol of a histogram
+def entropy(counts):
+    total = counts.sum()
+    if total == 0:
+        return 0.0
+    p = counts[counts > 0] / total
+    return float(-(p * np.log2(p)).sum())
+
+# row bands spread evenly over the image, together at most max_pixels
+def sample_rows(pixels, max_pixels=SAMPLE_PIXELS):
+    height, width = pixels.shape[:2]
+    bands = max(1, max_pixels // (BAND_ROWS * width))
+    step = -(-height // bands)
+    if step <= BAND_ROWS:
+        return pixels
+    return np.concatenate([pixels[start:start + BAND_ROWS] for start in range(0, height, step)])
+
+# statistics of one uint8 plane:
+#   entropy - zeroth-order entropy of the byte values, bits per byte
+#   conditional_entropy - entropy given the left neighbour, H(left, x) - H(left)
+#   repeats, mean_run - share of bytes equal to their left neighbour and the mean run length
+#   huffman_bits - bits per byte of a length-limited Huffman code built from the histogram
+def plane_statistics(plane):
+    values = plane.ravel()
+    counts = np.bincount(values, minlength=256)
+    left = plane[:, :-1].ravel().astype(np.int32)
+    current = plane[:, 1:].ravel()
+    pairs = np.bincount(left * 256 + current, minlength=256 * 256)
+    same = left == current
+    lengths = build_code_lengths({symbol: int(counts[symbol]) for symbol in np.flatnonzero(counts).tolist()})
+    return {
+        "entropy": entropy(counts),
+        "conditional_entropy": entropy(pairs) - entropy(pairs.reshape(256, 256).sum(axis=1)),
+        "repeats": float(same.mean()) if same.size else 0.0,
+        "mean_run": values.size / max(1, values.size - int(same.sum())),
+        "huffman_bits": float(counts @ lengths) / max(1, values.size),
+    }
+
+# statistics of the planes a codec would see after the given pre-transform, averaged over channels;
+# with a predictor the entropies are those of the prediction residuals
+def analyze(pixels, color_transform="none", predictor="none", max_pixels=SAMPLE_PIXELS):
+    planes = transforms.forward(sample_rows(np.asarray(pixels), max_pixels), color_transform, predictor)
+    channels = [plane_statistics(planes[:, :, c]) for c in range(planes.shape[2])]
+    return {feature: float(np.mean([channel[feature] for channel in channels])) for feature in FEATURES}
+
+# container bytes around the payloads: header, index and checksum, plus Huffman's code tables
+def overhead_bytes(name, width, height):
+    tiles = len(container.tile_grid(width, height, container.TILE_SIZE, container.TILE_SIZE)) * 3
+    return container.HEADER.size + tiles * (container.INDEX_ENTRY.itemsize + (128 if name == "Huffman" else 0)) + 4
+
+# predicted compressed size and encode time of every candidate configuration, smallest first
+# returns dicts with codec (a registry Codec), bytes, encode_ms and the statistics they came from
+def estimate(pixels, max_pixels=SAMPLE_PIXELS):
+    pixels = np.asarray(pixels)
+    height, width = pixels.shape[:2]
+    size = pixels.size
+    statistics = {}
+    estimates = []
+    for name, params in CANDIDATES:
+        transform = params.get("color_transform", "none"), params.get("predictor", "none")
+        if transform not in statistics:
+            statistics[transform] = analyze(pixels, *transform, max_pixels)
+        stats = statistics[transform]
+        features = (stats["entropy"], stats["conditional_entropy"], stats["repeats"], stats["huffman_bits"], 1.0)
+        bits = max(0.0, float(np.dot(SIZE_MODELS[name], features)))
+        base, per_bit = TIME_MODELS[name]
+        estimates.append({
+            "codec": get_codec(name, **params),
+            "bytes": int(size * bits / 8) + overhead_bytes(name, width, height),
+            "encode_ms": size * (base + per_bit * bits) / 1000,
+            "statistics": stats,
+        })
+    return sorted(estimates, key=lambda item: item["bytes"])
+
+# the codec configuration predicted to give the smallest file
+# max_encode_ms skips configurations predicted to be slower, unless none is fast enough
+def recommend(pixels, max_encode_ms=None, max_pixels=SAMPLE_PIXELS):
+    estimates = estimate(pixels, max_pixels)
+    if max_encode_ms is not None:
+        fast = [item for item in estimates if item["encode_ms"] <= max_encode_ms]
+        estimates = fast or sorted(estimates, key=lambda item: item["encode_ms"])
+    return estimates[0]["codec"]
+
+# predicted against measured size and encode time of every candidate on every image of a directory
+def accuracy_report(paths, stream=sys.stdout):
+    hits = 0
+    size_errors = []
+    time_errors = []
+    print(f"{'image':<16}{'codec':<60}{'predicted':>12}{'actual':>12}{'error':>8}{'pred ms':>10}{'ms':>10}",
+          file=stream)
+    for path in paths:
+        pixels = np.asarray(Image.open(path).convert("RGB"))
+        start = time.perf_counter()
+        estimates = estimate(pixels)
+        analysis_ms = (time.perf_counter() - start) * 1000
+        actual = []
+        for item in estimates:
+            start = time.perf_counter()
+            size = len(item["codec"].encode(pixels))
+            encode_ms = (time.perf_counter() - start) * 1000
+            actual.append(size)
+            size_errors.append(abs(item["bytes"] - size) / size)
+            time_errors.append(abs(item["encode_ms"] - encode_ms) / encode_ms)
+            print(f"{os.path.basename(path):<16}{item['codec']!r:<60}{item['bytes']:>12}{size:>12}"
+                  f"{(item['bytes'] - size) / size:>+8.1%}{item['encode_ms']:>10.1f}{encode_ms:>10.1f}", file=stream)
+        best = min(range(len(actual)), key=actual.__getitem__)
+        hits += best == 0
+        print(f"{os.path.basename(path):<16}recommended {estimates[0]['codec']!r}, best {estimates[best]['codec']!r} "
+              f"({actual[0] / actual[best] - 1:+.1%} larger), analysis {analysis_ms:.1f} ms", file=stream)
+    print(f"best codec predicted for {hits}/{len(paths)} images, mean size error {np.mean(size_errors):.1%}, "
+          f"mean encode time error {np.mean(time_errors):.1%}", file=stream)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the codec advisor's predictions against real runs.")
+    parser.add_argument("--images", default="test_images", help="directory with the input images")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    # imported here, benchmark imports this module for the auto choice
+    from benchmark import find_images
+    args = parse_args(argv)
+    paths = find_images(args.images)
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+    accuracy_report(paths)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+from compressors import profiling, models
+from compressors.registry import CODECS, get_codec
+from advisor import AUTO, recommend
+from metrics import compression_rate, calculate_metrics
+from result_cache import CACHE_DIR, ResultCache, result_key, pixels_digest
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff', '*.pgm', '*.ppm', '*.gif', '*.webp')
+
+# parameter sweeps for the lossy codecs, the same values the GUI offers
+JPEG_QUALITIES = [30, 50, 75, 90, 95, 100]
+JPEG2000_RATIOS = [5, 10, 20, 50]
+
+# fields written for every image x codec x parameter case, stages only with --profile
+FIELDS = ["image", "codec", "params", "compressed_bytes", "ratio", "psnr", "ssim",
+          "encode_ms", "decode_ms", "encode_ms_min", "decode_ms_min", "peak_traced_kb", "peak_rss_kb", "error",
+          "stages"]
+
+# the fields the result cache keeps: they only depend on the pixels, codec parameters and codec version;
+# timings and memory are always measured, and the ratio depends on the size of the source file
+CACHED_FIELDS = ["compressed_bytes", "psnr", "ssim"]
+
+# --profile choices: stage timings only, or with an extra capture
+PROFILE_CHOICES = ["stages"] + profiling.CAPTURES
+
+def find_images(directory):
+    paths = []
+    for ext in IMAGE_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(directory, ext)))
+    return sorted(paths)
+
+# codecs that can use a trained codebook model (compressors/models.py)
+MODEL_CODECS = ("Huffman", "DEFLATE")
+
+# every codec configuration to run, lossy codecs once per parameter value
+# AUTO is passed through, run_case asks the advisor which codec to use on each image;
+# with a model the codecs that take one also run with it and the pre-transform it was trained
+# with, plus once with that pre-transform alone so the model's share of the gain is visible
+def codec_sweep(names, model=None):
+    for name in names:
+        if model and name in MODEL_CODECS:
+            yield get_codec(name, color_transform=model.color_transform, predictor=model.predictor, model=model.id)
+            if (model.color_transform, model.predictor) != ("none", "none"):
+                yield get_codec(name, color_transform=model.color_transform, predictor=model.predictor)
+        if name == AUTO:
+            yield AUTO
+        elif name == "JPEG":
+            for quality in JPEG_QUALITIES:
+                yield get_codec(name, quality=quality)
+        elif name == "JPEG 2000":
+            for ratio in JPEG2000_RATIOS:
+                yield get_codec(name, compression_ratio=ratio)
+        else:
+            yield get_codec(name)
+
+# process-wide peak resident set size in KB
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+# time encode and decode separately, returns (encoded bytes, decoded pixels, encode ns list, decode ns list)
+def time_codec(codec, pixels, warmup, repeat):
+    for _ in range(warmup):
+        codec.decode(codec.encode(pixels))
+
+    encode_times = []
+    decode_times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        data = codec.encode(pixels)
+        encode_times.append(time.perf_counter_ns() - start)
+
+        start = time.perf_counter_ns()
+        decoded = codec.decode(data)
+        decode_times.append(time.perf_counter_ns() - start)
+    return data, decoded, encode_times, decode_times
+
+# peak python/numpy allocation of one encode+decode cycle, in its own untimed run
+def traced_peak_kb(codec, pixels):
+    tracemalloc.start()
+    try:
+        codec.decode(codec.encode(pixels))
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+# per-stage breakdown of one encode+decode cycle, in its own untimed run like traced_peak_kb
+def profile_stages(codec, pixels, capture=None):
+    with profiling.Profile(capture) as profile:
+        codec.decode(codec.encode(pixels))
+    return profile
+
+# cached size and quality of a case, only if it has every cached field and the same compressed size
+def cached_quality(cache, key, compressed_bytes):
+    record = cache.get(key) if cache is not None else None
+    if record is None or any(field not in record for field in CACHED_FIELDS):
+        return None
+    if record["compressed_bytes"] != compressed_bytes:
+        return None
+    return {field: record[field] for field in CACHED_FIELDS}
+
+# profile is one of PROFILE_CHOICES, its stage breakdown goes into the row and to stderr
+def run_case(path, original_img, codec, warmup, repeat, cache=None, digest=None, profile=None):
+    pixels = np.asarray(original_img)
+    if codec == AUTO:
+        # recorded as its own case, with the codec the advisor picked among the params
+        codec = recommend(pixels)
+        row = {"image": os.path.basename(path), "codec": AUTO,
+               "params": json.dumps({"codec": codec.name, **codec.params}, sort_keys=True)}
+    else:
+        row = {"image": os.path.basename(path), "codec": codec.name, "params": json.dumps(codec.params, sort_keys=True)}
+    if profile:
+        try:
+            profiled = profile_stages(codec, pixels, None if profile == "stages" else profile)
+            row["stages"] = profiled.rows()
+            print(profiled.format(), file=sys.stderr)
+        except Exception:
+            pass  # the measured run below reports the error
+    key = result_key(digest or pixels_digest(pixels), codec)
+    try:
+        data, decoded, encode_times, decode_times = time_codec(codec, pixels, warmup, repeat)
+        # the cache only saves the quality metrics, timings are never reused
+        quality = cached_quality(cache, key, len(data))
+        cached = quality is not None
+        if not cached:
+            quality = {"compressed_bytes": len(data), **calculate_metrics(pixels, decoded, ["psnr", "ssim"])}
+        row.update({
+            **quality,
+            "ratio": compression_rate(os.path.getsize(path), len(data)),
+            "encode_ms": statistics.median(encode_times) / 1e6,
+            "decode_ms": statistics.median(decode_times) / 1e6,
+            "encode_ms_min": min(encode_times) / 1e6,
+            "decode_ms_min": min(decode_times) / 1e6,
+            "peak_traced_kb": traced_peak_kb(codec, pixels),
+            "peak_rss_kb": peak_rss_kb(),
+        })
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+    if cache is not None and not cached:
+        cache.put(key, {field: row[field] for field in CACHED_FIELDS})
+    return row
+
+def case_key(row):
+    return row["image"], row["codec"], row["params"]
+
+# compare results against a saved baseline, returns a list of regression messages
+def find_regressions(rows, baseline_rows, tolerance):
+    baseline = {case_key(row): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        base = baseline.get(case_key(row))
+        name = " / ".join(case_key(row))
+        if base is None:
+            continue
+        if row.get("error") and not base.get("error"):
+            regressions.append(f"{name}: now fails with {row['error']}")
+            continue
+        if base.get("error") or row.get("error"):
+            continue
+        # the fastest run is the least noisy figure to compare
+        for field in ("encode_ms_min", "decode_ms_min"):
+            if row[field] > base[field] * (1 + tolerance):
+                regressions.append(f"{name}: {field} {base[field]:.1f} -> {row[field]:.1f}")
+        if row["compressed_bytes"] > base["compressed_bytes"]:
+            regressions.append(f"{name}: compressed_bytes {base['compressed_bytes']} -> {row['compressed_bytes']}")
+        if row["psnr"] < base["psnr"] - 1e-6:
+            regressions.append(f"{name}: psnr {base['psnr']:.2f} -> {row['psnr']:.2f}")
+    return regressions
+
+def write_results(rows, output, output_format):
+    stream = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if output_format == "json":
+            json.dump(rows, stream, indent=2)
+            stream.write("\n")
+        else:
+            writer = csv.DictWriter(stream, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows({**row, "stages": json.dumps(row["stages"])} if "stages" in row else row for row in rows)
+    finally:
+        if output:
+            stream.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every codec over a directory of images.")
+    parser.add_argument("--images", default="test_images", help="directory with the input images")
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS) + [AUTO], metavar="CODEC",
+                        help=f"codecs to run, {AUTO} lets the advisor pick a lossless one per image (default: all)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before measuring")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="output format")
+    parser.add_argument("--output", help="output file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results to compare against, regressions exit with status 1")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown against the baseline (default: 0.10)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always compute the quality metrics, without reading or writing the result cache")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help=f"result cache directory (default: {CACHE_DIR})")
+    parser.add_argument("--model", help=f"id of a trained model to also run "
+                                         f"{' and '.join(MODEL_CODECS)} with, using the pre-transform it was "
+                                         f"trained with (see train_model.py)")
+    parser.add_argument("--model-dir", help=f"directory to look the model up in before ${models.MODEL_PATH_ENV} "
+                                            f"and {models.MODEL_DIR}")
+    parser.add_argument("--profile", choices=PROFILE_CHOICES,
+                        help="add a per-stage breakdown from one extra untimed run, optionally with a "
+                             "cProfile or tracemalloc capture")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = find_images(args.images)
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+
+    model = None
+    if args.model:
+        try:
+            model = models.load(args.model, args.model_dir)
+        except ValueError as e:
+            sys.exit(str(e))
+        if model.predictor == "none":
+            print(f"Warning: model {model.id} was trained without a predictor, its shared Huffman tables "
+                  f"rarely beat per-tile ones", file=sys.stderr)
+
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    rows = []
+    for path in paths:
+        original_img = Image.open(path).convert("RGB")
+        digest = pixels_digest(np.asarray(original_img))
+        for codec in codec_sweep(args.codecs, model):
+            row = run_case(path, original_img, codec, args.warmup, args.repeat, cache, digest, args.profile)
+            rows.append(row)
+            status = row.get("error") or f"{row['encode_ms']:.1f} ms / {row['decode_ms']:.1f} ms"
+            print(f"{row['image']} {row['codec']} {row['params']}: {status}", file=sys.stderr)
+
+    write_results(rows, args.output, args.format)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(rows, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            for message in regressions:
+                print(f"  {message}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
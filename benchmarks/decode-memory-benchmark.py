@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import glob
+import tempfile
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import huffman, lzw, deflate, container, transforms
+
+# peak traced python/numpy allocation of a call, in KB
+def peak_kb(run):
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+# the decode path before the memory-mapped one: the whole file is read into bytes, tiles are
+# decoded into planar (3, h, w) channels, transposed into a contiguous (h, w, 3) copy and the
+# transforms undone into another array (the codecs' own tile decoders are the current ones)
+def decompress_before(input_path, output_image_path):
+    with open(input_path, "rb") as f:
+        data = f.read()
+    layout = container.read_layout(io.BytesIO(data))
+    module = container.codec_module(layout.codec_id)
+    view = memoryview(data)
+    payloads = [container.check_payload(view[layout.data_offset + offset:layout.data_offset + offset + length], entry)
+                for entry, offset, length in zip(layout.index, layout.index["offset"].tolist(),
+                                                 layout.index["length"].tolist())]
+
+    # payloads are stored tile after tile, three channels each
+    grid = container.tile_grid(layout.width, layout.height, layout.tile_width, layout.tile_height)
+    planes = np.empty((3, layout.height, layout.width), dtype=np.uint8)
+    for (y0, y1, x0, x1), tile_payloads in zip(grid, zip(*[iter(payloads)] * 3)):
+        for c, payload in enumerate(tile_payloads):
+            decoded = module.decode_tile(payload, (y1 - y0) * (x1 - x0), layout.params)
+            planes[c, y0:y1, x0:x1] = np.frombuffer(decoded, dtype=np.uint8).reshape(y1 - y0, x1 - x0)
+
+    pixels = planes.transpose(1, 2, 0)
+    if (layout.color_transform, layout.predictor) == ("none", "none"):
+        pixels = np.ascontiguousarray(pixels)
+    else:
+        output = np.empty((layout.height, layout.width, 3), dtype=np.uint8)
+        for y0, y1, x0, x1 in grid:
+            output[y0:y1, x0:x1] = transforms.inverse(pixels[y0:y1, x0:x1], layout.color_transform,
+                                                      layout.predictor)
+        pixels = output
+    Image.fromarray(pixels, "RGB").save(output_image_path)
+
+print(f"{'image':<14}{'codec':<10}{'transform':<16}{'image KB':>10}{'file KB':>10}"
+      f"{'before KB':>11}{'after KB':>10}{'change':>9}")
+
+with tempfile.TemporaryDirectory() as directory:
+    compressed_path = os.path.join(directory, "image.bin")
+    output_path = os.path.join(directory, "image.png")
+    for path in sorted(glob.glob("test_images/*.tiff")):
+        pixels = np.array(Image.open(path).convert("RGB"))
+        for module in (huffman, lzw, deflate):
+            for color_transform, predictor in (("none", "none"), ("ycocg-r", "med")):
+                module.compress(path, compressed_path, color_transform=color_transform, predictor=predictor)
+                before = peak_kb(lambda: decompress_before(compressed_path, output_path))
+                assert np.array_equal(np.array(Image.open(output_path)), pixels)
+                after = peak_kb(lambda: module.decompress(compressed_path, output_path))
+                assert np.array_equal(np.array(Image.open(output_path)), pixels)
+                print(f"{os.path.basename(path):<14}{module.__name__.split('.')[-1]:<10}"
+                      f"{color_transform + '/' + predictor:<16}{pixels.nbytes // 1024:>10}"
+                      f"{os.path.getsize(compressed_path) // 1024:>10}{before:>11}{after:>10}"
+                      f"{after / before - 1:>+9.0%}")
@@ -0,0 +1,35 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import deflate
+
+# tile sizes to compare, 256 is the container default
+TILE_SIZES = [128, 256, 512]
+
+# the same images tiled 4x4 so every channel spans many container tiles
+images = [np.tile(np.array(Image.open(path).convert("RGB")), (4, 4, 1))
+          for path in sorted(glob.glob("test_images/*.tiff"))]
+total_mb = sum(pixels.nbytes for pixels in images) / 1e6
+
+def throughput(run):
+    start = time.perf_counter()
+    run()
+    return total_mb / (time.perf_counter() - start)
+
+print(f"{os.cpu_count()} cpus, {total_mb:.1f} MB of pixels")
+print(f"{'tile size':<11}{'threads':>8}{'bytes':>12}{'encode MB/s':>13}{'decode MB/s':>13}")
+
+for tile_size in TILE_SIZES:
+    for workers in range(1, max(os.cpu_count(), 4) + 1):
+        compressed = [deflate.encode(pixels, tile_size=tile_size, workers=workers) for pixels in images]
+        encode_rate = throughput(lambda: [deflate.encode(pixels, tile_size=tile_size, workers=workers)
+                                          for pixels in images])
+        decode_rate = throughput(lambda: [deflate.decode(data, workers=workers) for data in compressed])
+        size = sum(len(data) for data in compressed)
+        print(f"{tile_size:<11}{workers:>8}{size:>12}{encode_rate:>13.1f}{decode_rate:>13.1f}")
@@ -0,0 +1,46 @@
+import os
+import sys
+import glob
+import time
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import huffman
+
+image_paths = sorted(glob.glob("test_images/*.tiff"))
+
+print(f"{'image':<14}{'encode ref ms':>15}{'encode ms':>11}{'decode ref ms':>15}{'decode ms':>11}  identical")
+
+for path in image_paths:
+    image = Image.open(path).convert("RGB")
+    channels = [channel.tobytes() for channel in image.split()]
+
+    times = [0, 0, 0, 0]
+    identical = True
+
+    for channel in channels:
+        lengths = huffman.build_code_lengths(huffman.build_frequency_table(channel))
+        values = huffman.build_canonical_codes(lengths)
+        codes = huffman.codes_to_dict(values, lengths)
+
+        start = time.perf_counter()
+        reference = huffman.encode_data_reference(channel, codes)
+        times[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        encoded = huffman.encode_data(channel, values, lengths)
+        times[1] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference_decoded = huffman.decode_data_reference(encoded, codes)
+        times[2] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = huffman.decode_data(encoded, codes, len(channel))
+        times[3] += time.perf_counter() - start
+
+        identical = identical and reference == encoded and bytes(reference_decoded) == decoded == channel
+
+    print(f"{os.path.basename(path):<14}" + "".join(f"{t * 1000:>{w}.1f}" for t, w in zip(times, (15, 11, 15, 11)))
+          + f"  {identical}")
@@ -0,0 +1,104 @@
+import os
+import sys
+import glob
+import time
+import tempfile
+import numpy as np
+import glymur
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import jpeg2000
+
+# encoder settings to compare: (compression ratios, tile size, resolutions, progression)
+CONFIGURATIONS = [
+    (10, None, None, None),
+    (10, 256, None, None),
+    (10, 128, 3, None),
+    ([40, 20, 10], None, None, "LRCP"),
+    ([40, 20, 10], 256, 6, "RPCL"),
+]
+
+# regions (x, y, width, height) decoded at every reduce level, some not aligned to any power of two
+REGIONS = [(100, 50, 200, 120), (3, 5, 101, 77), (256, 256, 256, 256)]
+
+# image sizes, tile sizes and level counts the resolution clamp must cope with
+SMALL_SHAPES = [(1, 1), (2, 3), (5, 7), (17, 40), (63, 64), (300, 300), (513, 257)]
+SMALL_TILES = [None, 16, 64, 256]
+SMALL_RESOLUTIONS = [None, 1, 6, 10]
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, (time.perf_counter() - start) * 1000
+
+# resolution levels recorded in the codestream of encoded bytes
+def levels_of(data):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.jp2")
+        with open(path, "wb") as f:
+            f.write(data)
+        return jpeg2000.resolution_levels(glymur.Jp2k(path))
+
+print(jpeg2000.LIBRARY_VERSION)
+images = [(os.path.basename(path), np.asarray(Image.open(path).convert("RGB")))
+          for path in sorted(glob.glob("test_images/*.tiff"))]
+
+# encode settings: sizes, the levels OpenJPEG wrote, full and reduced decode times
+print(f"{'image':<14}{'ratios':<14}{'tile':>6}{'res':>5}{'prog':>6}{'bytes':>9}{'levels':>8}{'encode ms':>11}"
+      f"{'decode ms':>11}  reduce ms")
+for name, pixels in images:
+    for ratios, tile_size, resolutions, progression in CONFIGURATIONS:
+        data, encode_ms = timed(lambda: jpeg2000.encode(pixels, ratios, tile_size, resolutions, progression))
+        levels = levels_of(data)
+        full, decode_ms = timed(lambda: jpeg2000.decode(data))
+        assert full.shape == pixels.shape
+        reduced = []
+        for reduce in range(1, levels + 1):
+            preview, ms = timed(lambda: jpeg2000.decode(data, reduce=reduce))
+            step = 2 ** reduce
+            assert preview.shape == (-(-pixels.shape[0] // step), -(-pixels.shape[1] // step), 3)
+            reduced.append(f"{ms:.0f}")
+        print(f"{name:<14}{str(ratios):<14}{str(tile_size or '-'):>6}{str(resolutions or '-'):>5}"
+              f"{progression or '-':>6}{len(data):>9}{levels:>8}{encode_ms:>11.1f}{decode_ms:>11.1f}  "
+              f"{' '.join(reduced)}")
+
+# a region decoded at reduce r must be the same pixels as that region of the whole image decoded at r,
+# with the region's full-resolution coordinates scaled down by 2^r
+print()
+print(f"{'image':<14}{'region':<22}{'reduce':>7}{'shape':>14}{'ms':>8}  identical")
+name, pixels = max(images, key=lambda image: image[1].size)
+data = jpeg2000.encode(pixels, [40, 20, 10], tile_size=256, resolutions=6, progression="RPCL")
+for reduce in range(levels_of(data) + 1):
+    whole = jpeg2000.decode(data, reduce=reduce)
+    step = 2 ** reduce
+    for x, y, width, height in REGIONS:
+        if x + width > pixels.shape[1] or y + height > pixels.shape[0]:
+            continue
+        crop, ms = timed(lambda: jpeg2000.decode(data, reduce=reduce, region=(x, y, width, height)))
+        expected = whole[-(-y // step):-(-(y + height) // step), -(-x // step):-(-(x + width) // step)]
+        identical = crop.shape == expected.shape and np.array_equal(crop, expected)
+        print(f"{name:<14}{str((x, y, width, height)):<22}{reduce:>7}{str(crop.shape[:2]):>14}{ms:>8.1f}  {identical}")
+
+# small and tiled images: the resolution count must be clamped to what the smallest tile side
+# allows, and every level the codestream records must be decodable
+print()
+failures = []
+rng = np.random.default_rng(0)
+for shape in SMALL_SHAPES:
+    pixels = rng.integers(0, 256, shape + (3,), dtype=np.uint8)
+    for tile_size in SMALL_TILES:
+        for resolutions in SMALL_RESOLUTIONS:
+            try:
+                data = jpeg2000.encode(pixels, 10, tile_size, resolutions)
+                levels = levels_of(data)
+                assert jpeg2000.decode(data).shape == pixels.shape
+                assert jpeg2000.decode(data, reduce=levels).shape[:2] == tuple(-(-side // 2 ** levels)
+                                                                             for side in shape)
+            except Exception as e:
+                failures.append(f"{shape} tile={tile_size} resolutions={resolutions}: {type(e).__name__}: {e}")
+print(f"{len(SMALL_SHAPES) * len(SMALL_TILES) * len(SMALL_RESOLUTIONS)} small/tiled encodes, "
+      f"{len(failures)} failed")
+for failure in failures:
+    print(f"  {failure}")
@@ -0,0 +1,56 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import lzw
+
+# time the reference and the current packed LZW over the three channels,
+# returns pixels per second (reference compress, compress, reference decompress, decompress)
+# and whether both produce the same codes and the original pixels
+def measure(pixels):
+    channels = [pixels[:, :, i].tobytes() for i in range(3)]
+    count = pixels.shape[0] * pixels.shape[1]
+    times = [0, 0, 0, 0]
+
+    start = time.perf_counter()
+    reference = [lzw.lzw_compress_packed_reference(channel) for channel in channels]
+    times[0] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compressed = [lzw.lzw_compress_packed(channel) for channel in channels]
+    times[1] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference_decompressed = [lzw.lzw_decompress_packed_reference(data) for data in compressed]
+    times[2] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decompressed = [lzw.lzw_decompress_packed(data, count) for data in compressed]
+    times[3] = time.perf_counter() - start
+
+    identical = (reference == compressed and [bytes(d) for d in reference_decompressed] == channels
+                 and [bytes(d) for d in decompressed] == channels)
+    return [count / t for t in times], identical
+
+def report(label, pixels):
+    (ref_compress, compress, ref_decompress, decompress), identical = measure(pixels)
+    print(f"{label:<16}{pixels.shape[0] * pixels.shape[1]:>10}"
+          f"{ref_compress:>14,.0f}{compress:>14,.0f}{compress / ref_compress:>7.1f}x"
+          f"{ref_decompress:>14,.0f}{decompress:>14,.0f}{decompress / ref_decompress:>7.1f}x  {identical}")
+
+print(f"{'':<26}{'compress px/s':^36}{'decompress px/s':^36}")
+print(f"{'image':<16}{'pixels':>10}{'reference':>14}{'current':>14}{'speedup':>8}"
+      f"{'reference':>14}{'current':>14}{'speedup':>8}  identical")
+
+for path in sorted(glob.glob("test_images/*.tiff")):
+    report(os.path.basename(path), np.array(Image.open(path).convert("RGB")))
+
+# scaling: the same image tiled to 1x, 4x and 16x the pixel count
+pixels = np.array(Image.open("test_images/4.2.03.tiff").convert("RGB"))
+for factor in (1, 2, 4):
+    report(f"4.2.03 x{factor * factor}", np.tile(pixels, (factor, factor, 1)))
@@ -0,0 +1,45 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors.registry import get_codec
+
+# rANS against Huffman on the same tiled container, raw and with the lossless pre-transform
+CONFIGURATIONS = [
+    ("Huffman", {}),
+    ("rANS", {}),
+    ("rANS", {"lanes": 255}),
+    ("Huffman", {"color_transform": "ycocg-r", "predictor": "med"}),
+    ("rANS", {"color_transform": "ycocg-r", "predictor": "med"}),
+    ("rANS", {"order": 1}),
+]
+
+images = [(os.path.basename(path), np.asarray(Image.open(path).convert("RGB")))
+          for path in sorted(glob.glob("test_images/*.tiff"))]
+total_mb = sum(pixels.nbytes for _, pixels in images) / 1e6
+
+print(f"{'codec':<70}{'bytes':>10}{'encode MB/s':>13}{'decode MB/s':>13}  identical")
+for name, params in CONFIGURATIONS:
+    codec = get_codec(name, **params)
+    size = 0
+    encode_time = 0
+    decode_time = 0
+    identical = True
+    for _, pixels in images:
+        start = time.perf_counter()
+        data = codec.encode(pixels)
+        encode_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = codec.decode(data)
+        decode_time += time.perf_counter() - start
+
+        size += len(data)
+        identical = identical and np.array_equal(decoded, pixels)
+
+    print(f"{codec!r:<70}{size:>10}{total_mb / encode_time:>13.1f}{total_mb / decode_time:>13.1f}  {identical}")
@@ -0,0 +1,47 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compressors import jpeg, ratecontrol
+
+# targets searched on every image, one per search
+TARGETS = [{"max_bytes": 20_000}, {"max_bytes": 100_000}, {"min_psnr": 30}, {"min_psnr": 35}, {"min_psnr": 40},
+           {"min_ssim": 0.9}, {"min_ssim": 0.98}]
+
+images = [(os.path.basename(path), Image.open(path).convert("RGB")) for path in sorted(glob.glob("test_images/*.tiff"))]
+
+# every JPEG quality must encode and decode; the optimized save overflows Pillow's buffer on
+# some of them, those are the qualities jpeg.encode_image writes without optimized tables
+print(f"{'image':<14}{'qualities':>10}{'unoptimized':>13}  monotonic")
+for name, image in images:
+    fallbacks = []
+    sizes = []
+    for quality in range(1, 101):
+        try:
+            jpeg.save_image(image, quality, optimize=True)
+        except OSError:
+            fallbacks.append(quality)
+        data = jpeg.encode_image(image, quality)
+        assert jpeg.decode(data).shape == (image.height, image.width, 3)
+        sizes.append(len(data))
+    monotonic = all(a <= b for a, b in zip(sizes, sizes[1:]))
+    print(f"{name:<14}{len(sizes):>10}{','.join(map(str, fallbacks)) or '-':>13}  {monotonic}")
+
+print()
+print(f"{'image':<14}{'target':<22}{'quality':>8}{'bytes':>10}{'ms':>9}")
+for name, image in images:
+    pixels = np.asarray(image)
+    for target in TARGETS:
+        (key, limit), = target.items()
+        start = time.perf_counter()
+        try:
+            quality, data = ratecontrol.search("JPEG", pixels, **target)
+            result = f"{quality:>8}{len(data):>10}"
+        except ValueError:
+            result = f"{'-':>8}{'-':>10}"
+        print(f"{name:<14}{f'{key}={limit}':<22}{result}{(time.perf_counter() - start) * 1000:>9.0f}")
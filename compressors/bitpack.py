@@ -0,0 +1,40 @@
+import numpy as np
+
+# number of symbols packed per numpy pass, keeps temporary arrays bounded
+CHUNK_SIZE = 1 << 20
+
+# pack variable-length codes MSB-first into a contiguous byte buffer
+# values[i] holds a code of lengths[i] bits (between 1 and 57 bits per code)
+def pack_bits(values, lengths):
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+
+    total_bits = int(lengths.sum())
+    out = np.zeros((total_bits + 7) // 8 + 8, dtype=np.uint8)
+
+    bit_offset = 0
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk_values = values[start:start + CHUNK_SIZE]
+        chunk_lengths = lengths[start:start + CHUNK_SIZE]
+
+        # cumulative bit offset of every code
+        ends = np.cumsum(chunk_lengths) + bit_offset
+        starts = ends - chunk_lengths
+        first_byte = bit_offset >> 3
+        byte_index = (starts >> 3) - first_byte
+
+        # left-align each code in a 64-bit window beginning at its first byte
+        shifts = (64 - (starts & 7) - chunk_lengths).astype(np.uint64)
+        windows = chunk_values << shifts
+
+        # codes never overlap, so summing the bytes of every window is a bitwise or
+        lanes = (7 + int(chunk_lengths.max()) + 7) // 8
+        span = int(byte_index[-1]) + lanes
+        for lane in range(lanes):
+            lane_bytes = (windows >> np.uint64(56 - 8 * lane)) & np.uint64(0xFF)
+            counts = np.bincount(byte_index + lane, weights=lane_bytes, minlength=span)
+            out[first_byte:first_byte + span] += counts.astype(np.uint8)
+
+        bit_offset = int(ends[-1])
+
+    return out[:(total_bits + 7) // 8], total_bits
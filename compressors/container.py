@@ -0,0 +1,278 @@
+import io
+import mmap
+import zlib
+import struct
+import importlib
+import numpy as np
+from collections import namedtuple
+from compressors import transforms, tiles, profiling
+from compressors.strips import write_ppm
+
+# common tiled container of the lossless codecs (huffman, lzw, deflate, rans)
+#
+#   header    signature, version, codec id, image size, tile size, transform flags,
+#             then codec parameters of variable length
+#   index     offset, length and CRC-32 of every payload, tile after tile (row-major),
+#             three channels per tile, followed by a CRC-32 of header and index
+#   payloads  one compressed payload per tile and channel
+#
+# every tile is transformed and compressed on its own, so any region can be decoded
+# from just the tiles it overlaps
+MAGIC = b"TIC"
+FORMAT_VERSION = 1
+
+# default tile width and height in pixels
+TILE_SIZE = 256
+
+# codec module names by the id stored in the header
+CODEC_IDS = {1: "huffman", 2: "lzw", 3: "deflate", 4: "rans"}
+
+# signature, version, codec id, width, height, tile width, tile height, transform flags, parameter length
+HEADER = struct.Struct("<3sBBIIII2sH")
+INDEX_ENTRY = np.dtype([("offset", "<u8"), ("length", "<u4"), ("crc", "<u4")])
+
+# everything read from a container header, data_offset is where the payloads start
+Layout = namedtuple("Layout", ["codec_id", "width", "height", "tile_width", "tile_height",
+                               "color_transform", "predictor", "params", "index", "data_offset"])
+
+# (start_row, end_row, start_column, end_column) of every tile, row by row
+def tile_grid(width, height, tile_width, tile_height):
+    return [(y, min(y + tile_height, height), x, min(x + tile_width, width))
+            for y in range(0, height, tile_height) for x in range(0, width, tile_width)]
+
+# codec module that encodes and decodes the payloads of a container
+# it provides decode_tile(payload, count, params) returning the decoded tile bytes
+def codec_module(codec_id):
+    if codec_id not in CODEC_IDS:
+        raise ValueError(f"Unknown codec id in container: {codec_id}")
+    return importlib.import_module(f"compressors.{CODEC_IDS[codec_id]}")
+
+# regroup row strips of any height into blocks of whole tile rows, the last block takes the rest
+# a strip that already holds whole tile rows is passed on without copying
+def tile_row_blocks(strips, tile_height, height):
+    pending, count, done = [], 0, 0
+    for strip in strips:
+        pending.append(strip)
+        count += strip.shape[0]
+        ready = count if done + count >= height else count - count % tile_height
+        if ready:
+            block = pending[0] if len(pending) == 1 else np.concatenate(pending)
+            yield block[:ready]
+            pending = [np.array(block[ready:])] if ready < count else []
+            count -= ready
+            done += ready
+
+# compress every tile of a block of whole tile rows, tile after tile and three channels per tile
+def encode_payloads(pixels, encode_tile, args, color_transform, predictor, tile_size, parallel, workers):
+    height, width = pixels.shape[:2]
+    grid = tile_grid(width, height, tile_size, tile_size)
+
+    # transforms are tile-local, predictors see zeros outside the tile
+    planes = np.empty((3, height, width), dtype=np.uint8)
+    with profiling.stage("container.transform", planes.nbytes):
+        for y0, y1, x0, x1 in grid:
+            planes[:, y0:y1, x0:x1] = transforms.forward(pixels[y0:y1, x0:x1], color_transform,
+                                                         predictor).transpose(2, 0, 1)
+
+    tile_list = [(c, y0, y1, x0, x1) for y0, y1, x0, x1 in grid for c in range(3)]
+    with profiling.stage("container.encode_tiles", planes.nbytes) as stage:
+        payloads = tiles.encode_tiles(encode_tile, planes, tile_list, [args] * len(tile_list), parallel, workers)
+        stage.output(sum(len(payload) for payload in payloads))
+    return payloads
+
+# write a container for a width x height image arriving as (rows, w, 3) uint8 row strips to the
+# seekable file f; strips are encoded as soon as they fill a row of tiles, so memory use follows
+# the strip and tile size, not the image height, and the index is filled in at the end
+# encode_tile(data, *args) compresses one channel of one tile, params are stored in the header
+# and handed to the codec's decode_tile; parallel and workers are passed on to tiles.encode_tiles
+def encode_stream(strips, width, height, f, codec_id, encode_tile, args=(), params=b"", color_transform="none",
+                  predictor="none", tile_size=None, parallel=False, workers=None):
+    tile_size = tile_size or TILE_SIZE
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, codec_id, width, height, tile_size, tile_size,
+                         transforms.pack_flags(color_transform, predictor), len(params)) + params
+    index = np.zeros(3 * len(tile_grid(width, height, tile_size, tile_size)), dtype=INDEX_ENTRY)
+
+    start = f.tell()
+    f.write(header)
+    f.write(bytes(index.nbytes + 4))
+
+    entry, offset, rows = 0, 0, 0
+    for block in tile_row_blocks(strips, tile_size, height):
+        if block.shape[1:] != (width, 3) or rows + block.shape[0] > height:
+            raise ValueError(f"Strip of shape {block.shape} does not fit a {width}x{height} RGB image")
+        rows += block.shape[0]
+        payloads = encode_payloads(block, encode_tile, args, color_transform, predictor, tile_size, parallel, workers)
+        with profiling.stage("container.write") as stage:
+            for payload in payloads:
+                index[entry] = (offset, len(payload), zlib.crc32(payload))
+                f.write(payload)
+                entry += 1
+                offset += len(payload)
+            stage.output(sum(len(payload) for payload in payloads))
+    if rows != height:
+        raise ValueError(f"Got {rows} rows for an image of height {height}")
+
+    end = f.tell()
+    f.seek(start + len(header))
+    f.write(index.tobytes())
+    f.write(struct.pack("<I", zlib.crc32(header + index.tobytes())))
+    f.seek(end)
+
+# encode an (h, w, 3) uint8 array into a container, arguments as for encode_stream
+def encode(pixels, codec_id, encode_tile, args=(), params=b"", color_transform="none", predictor="none",
+           tile_size=None, parallel=False, workers=None):
+    height, width = pixels.shape[:2]
+    with io.BytesIO() as f:
+        encode_stream([pixels], width, height, f, codec_id, encode_tile, args, params, color_transform, predictor,
+                      tile_size, parallel, workers)
+        return f.getvalue()
+
+# bytes taken by header, parameters, index and checksum, from the fixed-size part of the header
+def table_size(fixed):
+    if len(fixed) < HEADER.size or fixed[:3] != MAGIC:
+        raise ValueError("Not a tiled container")
+    _, _, _, width, height, tile_width, tile_height, _, params_length = HEADER.unpack(fixed)
+    if tile_width == 0 or tile_height == 0:
+        raise ValueError("Invalid tile size in container")
+    entries = 3 * (-(-width // tile_width)) * (-(-height // tile_height))
+    return HEADER.size + params_length + entries * INDEX_ENTRY.itemsize + 4
+
+# read and check the header and index from a file object positioned at the start of a container
+def read_layout(f):
+    fixed = f.read(HEADER.size)
+    if len(fixed) < HEADER.size or fixed[:3] != MAGIC:
+        raise ValueError("Not a tiled container")
+    _, version, codec_id, width, height, tile_width, tile_height, flags, params_length = HEADER.unpack(fixed)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported container version: {version}")
+    if codec_id not in CODEC_IDS:
+        raise ValueError(f"Unknown codec id in container: {codec_id}")
+    if tile_width == 0 or tile_height == 0:
+        raise ValueError("Invalid tile size in container")
+    color_transform, predictor = transforms.unpack_flags(flags)
+
+    params = f.read(params_length)
+    entries = 3 * len(tile_grid(width, height, tile_width, tile_height))
+    index_bytes = f.read(entries * INDEX_ENTRY.itemsize)
+    checksum = f.read(4)
+    if len(index_bytes) != entries * INDEX_ENTRY.itemsize or len(checksum) != 4:
+        raise ValueError("Truncated container header")
+    if zlib.crc32(fixed + params + index_bytes) != struct.unpack("<I", checksum)[0]:
+        raise ValueError("Container header checksum mismatch")
+
+    index = np.frombuffer(index_bytes, dtype=INDEX_ENTRY)
+    return Layout(codec_id, width, height, tile_width, tile_height, color_transform, predictor,
+                  params, index, f.tell())
+
+def check_payload(payload, entry):
+    if len(payload) != entry["length"] or zlib.crc32(payload) != entry["crc"]:
+        raise ValueError("Tile checksum mismatch in container")
+    return payload
+
+# decode a whole container back into an (h, w, 3) uint8 array
+# data is any buffer (bytes, memoryview, mmap), payloads are passed to the codec as memoryviews
+# into it and every tile is decoded straight into the one output array;
+# codec_id, when given, is the codec the caller expects to find
+# tile_args are passed to the codec's decode_tile after the codec parameters
+def decode(data, parallel=False, workers=None, codec_id=None, tile_args=()):
+    view = memoryview(data)
+    with profiling.stage("container.read_index", view.nbytes):
+        with io.BytesIO(view[:table_size(view[:HEADER.size].tobytes())]) as f:
+            layout = read_layout(f)
+        if codec_id is not None and layout.codec_id != codec_id:
+            raise ValueError(f"Container holds {CODEC_IDS[layout.codec_id]} data, not {CODEC_IDS[codec_id]}")
+        module = codec_module(layout.codec_id)
+
+        payloads = [check_payload(view[layout.data_offset + offset:layout.data_offset + offset + length], entry)
+                    for entry, offset, length in zip(layout.index, layout.index["offset"].tolist(),
+                                                     layout.index["length"].tolist())]
+
+    grid = tile_grid(layout.width, layout.height, layout.tile_width, layout.tile_height)
+    tile_list = [(c, y0, y1, x0, x1) for y0, y1, x0, x1 in grid for c in range(3)]
+    args = [((y1 - y0) * (x1 - x0), layout.params, *tile_args) for _, y0, y1, x0, x1 in tile_list]
+    with profiling.stage("container.decode_tiles", sum(len(payload) for payload in payloads)) as stage:
+        pixels = tiles.decode_tiles(module.decode_tile, (layout.height, layout.width, 3), tile_list, payloads,
+                                    args, parallel, workers)
+        stage.output(pixels.nbytes)
+
+    # transforms are undone in place, one tile at a time
+    if (layout.color_transform, layout.predictor) != ("none", "none"):
+        with profiling.stage("container.inverse_transform", pixels.nbytes):
+            for y0, y1, x0, x1 in grid:
+                pixels[y0:y1, x0:x1] = transforms.inverse(pixels[y0:y1, x0:x1], layout.color_transform,
+                                                          layout.predictor)
+    return pixels
+
+# read-only memory map of a compressed file, so decoding reads pages on demand instead of
+# copying the whole file; the map is closed once the last view into it is gone
+def map_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# read the payloads of index entries first to first + count, which are stored back to back
+def read_payloads(f, layout, first, count):
+    entries = layout.index[first:first + count]
+    f.seek(layout.data_offset + int(entries["offset"][0]))
+    data = memoryview(f.read(int(entries["length"].sum())))
+    ends = np.cumsum(entries["length"], dtype=np.int64).tolist()
+    return [check_payload(data[end - length:end], entry)
+            for entry, end, length in zip(entries, ends, entries["length"].tolist())]
+
+# decode the three channel payloads of a height x width tile and undo its transforms
+def decode_tile_pixels(module, layout, payloads, height, width):
+    tile = np.empty((height, width, 3), dtype=np.uint8)
+    for c, payload in enumerate(payloads):
+        decoded = module.decode_tile(payload, height * width, layout.params)
+        tile[:, :, c] = np.frombuffer(decoded, dtype=np.uint8).reshape(height, width)
+    return transforms.inverse(tile, layout.color_transform, layout.predictor)
+
+# decode the region of width x height pixels at (x, y) of a container file
+# only the header, the index and the payloads of the overlapping tiles are read
+def decode_region(path, x, y, width, height):
+    with open(path, "rb") as f:
+        layout = read_layout(f)
+        if width <= 0 or height <= 0 or x < 0 or y < 0 or x + width > layout.width or y + height > layout.height:
+            raise ValueError(f"Region {width}x{height} at ({x}, {y}) is outside the "
+                             f"{layout.width}x{layout.height} image")
+        module = codec_module(layout.codec_id)
+        tile_width, tile_height = layout.tile_width, layout.tile_height
+        columns = -(-layout.width // tile_width)
+
+        region = np.empty((height, width, 3), dtype=np.uint8)
+        for row in range(y // tile_height, (y + height - 1) // tile_height + 1):
+            for column in range(x // tile_width, (x + width - 1) // tile_width + 1):
+                y0, x0 = row * tile_height, column * tile_width
+                y1, x1 = min(y0 + tile_height, layout.height), min(x0 + tile_width, layout.width)
+                payloads = read_payloads(f, layout, 3 * (row * columns + column), 3)
+                tile = decode_tile_pixels(module, layout, payloads, y1 - y0, x1 - x0)
+
+                top, bottom = max(y0, y), min(y1, y + height)
+                left, right = max(x0, x), min(x1, x + width)
+                region[top - y:bottom - y, left - x:right - x] = tile[top - y0:bottom - y0, left - x0:right - x0]
+        return region
+
+# decode a container file one row of tiles at a time
+# returns width, height and an iterator over (rows, w, 3) uint8 strips, top to bottom;
+# only one strip and its payloads are held in memory, f must stay open while iterating
+def decode_strips(f):
+    layout = read_layout(f)
+    module = codec_module(layout.codec_id)
+
+    def strips():
+        grid = tile_grid(layout.width, layout.height, layout.tile_width, layout.tile_height)
+        columns = -(-layout.width // layout.tile_width)
+        for first in range(0, len(grid), columns):
+            row = grid[first:first + columns]
+            payloads = read_payloads(f, layout, 3 * first, 3 * len(row))
+            strip = np.empty((row[0][1] - row[0][0], layout.width, 3), dtype=np.uint8)
+            for k, (y0, y1, x0, x1) in enumerate(row):
+                strip[:, x0:x1] = decode_tile_pixels(module, layout, payloads[3 * k:3 * k + 3], y1 - y0, x1 - x0)
+            yield strip
+
+    return layout.width, layout.height, strips()
+
+# decompress a container file strip by strip into a binary PPM image, with flat memory use
+def decompress_stream(input_path, output_path):
+    with open(input_path, "rb") as f:
+        width, height, strips = decode_strips(f)
+        write_ppm(output_path, width, height, strips)
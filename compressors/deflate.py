@@ -1,36 +1,149 @@
+import io
 import zlib
 from PIL import Image
 import struct
 import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from compressors import transforms, container, strips, profiling, models
 
-def compress(input_image_path, output_path):
-    image = Image.open(input_image_path).convert("RGB")
-    r, g, b = image.split()
+# file signature followed by a format version byte
+# files without it are the legacy layout with one zlib stream per channel
+# version 3 adds the pre-transform flags after the image dimensions;
+# version 4 files are written in the common tiled container (compressors/container.py)
+MAGIC = b"DFL"
+FORMAT_VERSION = 4
 
-    channels = [r.tobytes(), g.tobytes(), b.tobytes()]
-    compressed_channels = [zlib.compress(channel, level=9) for channel in channels]
+# codec id in the tiled container
+CONTAINER_ID = 3
 
-    with open(output_path, "wb") as f:
-        f.write(struct.pack("II", image.width, image.height))
-        for data in compressed_channels:
-            f.write(struct.pack("I", len(data)))
+# decompress the independent blocks of a version 2/3 file on a thread pool and join them in order
+def decompress_blocks(blocks, block_size, workers=None):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return b"".join(executor.map(partial(zlib.decompress, bufsize=max(block_size, 1)), blocks))
+
+# one zlib stream per channel of a container tile
+# with a model the tile is a flag byte and a raw deflate stream instead: the container already
+# checksums every payload, so the zlib header and Adler-32 are left out; flag 1 means the stream
+# starts from the model's preset dictionary, which is only kept where it makes the tile smaller
+def encode_tile(data, level=9, model=None):
+    with profiling.stage("deflate.zlib_compress", len(data)) as stage:
+        if model is None:
+            compressed = zlib.compress(data, level)
+        else:
+            compressed = bytes([0]) + raw_deflate(data, level)
+            if model.zdict:
+                primed = bytes([1]) + raw_deflate(data, level, model.zdict)
+                compressed = min(compressed, primed, key=len)
+        stage.output(len(compressed))
+    return compressed
+
+def raw_deflate(data, level, zdict=None):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **({"zdict": zdict} if zdict else {}))
+    return compressor.compress(data) + compressor.flush()
+
+# params hold the id of the model the file was coded with, if any, looked up in model_dir before the
+# default search path
+def decode_tile(payload, count, params=b"", model_dir=None):
+    with profiling.stage("deflate.zlib_decompress", len(payload)) as stage:
+        stage.output(count)
+        if not params:
+            return zlib.decompress(payload, bufsize=max(count, 1))
+        if payload[0] == 1:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=models.load(params, model_dir).zdict)
+        elif payload[0] == 0:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            raise ValueError(f"Unknown DEFLATE tile flag: {payload[0]}")
+        decompressed = decompressor.decompress(payload[1:], count)
+        if len(decompressed) != count or not decompressor.eof:
+            raise ValueError("Truncated DEFLATE tile")
+        return decompressed
+
+# tile encoder arguments and container parameters, with or without a model's preset dictionary
+def tile_coder(level, model, model_dir=None):
+    if model is None:
+        return (level,), b""
+    model = models.resolve(model, model_dir)
+    return (level, model), bytes.fromhex(model.id)
+
+# encode an (h, w, 3) uint8 array with DEFLATE in the tiled container,
+# one independent zlib stream per tile_size x tile_size tile and channel
+# tiles are compressed on a thread pool, since zlib releases the GIL
+# color_transform and predictor select an optional reversible pre-transform;
+# model (a trained model or its id, see compressors/models.py) primes streams with its preset dictionary,
+# model_dir is a directory (or list of them) to look the model id up in before the default search path
+def encode(pixels, level=9, tile_size=None, workers=None, color_transform="none", predictor="none", model=None,
+           model_dir=None):
+    args, params = tile_coder(level, model, model_dir)
+    return container.encode(pixels, CONTAINER_ID, encode_tile, args, params, color_transform, predictor,
+                            tile_size, "threads", workers)
+
+# encode an image arriving as (rows, w, 3) uint8 row strips into the seekable file f, params as for encode
+def encode_stream(image_strips, width, height, f, level=9, tile_size=None, workers=None, color_transform="none",
+                  predictor="none", model=None, model_dir=None):
+    args, params = tile_coder(level, model, model_dir)
+    container.encode_stream(image_strips, width, height, f, CONTAINER_ID, encode_tile, args, params, color_transform,
+                            predictor, tile_size, "threads", workers)
+
+# compress an RGB image with DEFLATE, params as for encode
+def compress(input_image_path, output_path, **params):
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+    data = encode(np.asarray(image), **params)
+    with profiling.stage("io.write_file", len(data)):
+        with open(output_path, "wb") as f:
             f.write(data)
 
+# compress an image read in row strips, memory use does not grow with the image height
+def compress_stream(input_image_path, output_path, strip_rows=strips.STRIP_ROWS, **params):
+    width, height, image_strips = strips.read_strips(input_image_path, strip_rows)
+    with open(output_path, "wb") as f:
+        encode_stream(image_strips, width, height, f, **params)
+
+# decode DEFLATE-compressed bytes back into an (h, w, 3) uint8 array, tiles and blocks are inflated in parallel
+# model_dir as for encode
+def decode(data, workers=None, model_dir=None):
+    if data[:3] == container.MAGIC:
+        return container.decode(data, "threads", workers, CONTAINER_ID, (model_dir,))
+
+    with io.BytesIO(data) as f:
+        signature = f.read(4)
+        color_transform, predictor = "none", "none"
+        if signature[:3] == MAGIC:
+            version = signature[3]
+            if version not in (2, 3):
+                raise ValueError(f"Unsupported DEFLATE format version: {version}")
+            width, height = struct.unpack("II", f.read(8))
+            if version >= 3:
+                color_transform, predictor = transforms.unpack_flags(f.read(2))
+            block_size, block_count = struct.unpack("II", f.read(8))
+            lengths = np.frombuffer(f.read(4 * block_count), dtype=np.uint32)
+            payload = memoryview(f.read())
+        else:
+            # legacy files start directly with the image dimensions
+            width, height = struct.unpack("II", signature + f.read(4))
+            block_size = width * height
+            lengths = []
+            chunks = []
+            for _ in range(3):
+                length = struct.unpack("I", f.read(4))[0]
+                lengths.append(length)
+                chunks.append(f.read(length))
+            payload = memoryview(b"".join(chunks))
 
-def decompress(input_path, output_image_path):
-    with open(input_path, "rb") as f:
-        width, height = struct.unpack("II", f.read(8))
-        channels = []
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).tolist()
+    blocks = [payload[start:end] for start, end in zip(offsets, offsets[1:])]
+    decompressed = decompress_blocks(blocks, block_size, workers)
 
-        for _ in range(3):
-            length = struct.unpack("I", f.read(4))[0]
-            data = f.read(length)
-            decompressed = zlib.decompress(data)
-            channels.append(bytes(decompressed))
+    channel_size = width * height
+    pixels = np.frombuffer(decompressed, dtype=np.uint8)[:3 * channel_size].reshape(3, height, width).transpose(1, 2, 0)
+    pixels = transforms.inverse(pixels, color_transform, predictor)
+    return np.ascontiguousarray(pixels)
 
-    r = Image.frombytes("L", (width, height), channels[0])
-    g = Image.frombytes("L", (width, height), channels[1])
-    b = Image.frombytes("L", (width, height), channels[2])
-    image = Image.merge("RGB", (r, g, b))
-    image.save(output_image_path)
\ No newline at end of file
+# decompress a DEFLATE-compressed RGB image
+def decompress(input_path, output_image_path, **options):
+    pixels = decode(container.map_file(input_path), **options)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path)
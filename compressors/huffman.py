@@ -1,9 +1,29 @@
 import heapq
+import io
 import os
-from collections import defaultdict
 from PIL import Image
+import numpy as np
 import pickle
 import struct
+from compressors.bitpack import pack_bits
+from compressors import transforms, tiles, container, strips, profiling, models
+
+# longest code the canonical coder will assign (same limit as DEFLATE)
+MAX_CODE_LENGTH = 15
+
+# number of bits resolved by a single decode table lookup
+TABLE_BITS = 10
+
+# file signature followed by a format version byte
+# files without it are the legacy layout with pickled code tables
+# version 3 adds the pre-transform flags after the image dimensions,
+# version 4 the tile height, followed by one payload per tile;
+# version 5 files are written in the common tiled container (compressors/container.py)
+MAGIC = b"HUF"
+FORMAT_VERSION = 5
+
+# codec id in the tiled container
+CONTAINER_ID = 1
 
 # huffman tree node
 class Node:
@@ -18,10 +38,8 @@ class Node:
 
 # build frequency table from input data
 def build_frequency_table(data):
-    freq = defaultdict(int)
-    for byte in data:
-        freq[byte] += 1
-    return freq
+    counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    return {symbol: int(counts[symbol]) for symbol in np.flatnonzero(counts).tolist()}
 
 # construct the huffman tree using a priority queue
 def build_huffman_tree(freq_table):
@@ -54,8 +72,58 @@ def build_codes(root):
     traverse(root)
     return codes
 
-# encode raw data into a binary bitstring using the huffman codes
-def encode_data(data, codes):
+# derive code lengths from the huffman tree, limited to max_length bits
+# frequencies are flattened and the tree rebuilt until the limit holds
+def build_code_lengths(freq_table, max_length=MAX_CODE_LENGTH):
+    lengths = np.zeros(256, dtype=np.uint8)
+    if not freq_table:
+        return lengths
+
+    while True:
+        codes = build_codes(build_huffman_tree(freq_table))
+        longest = max(len(code) for code in codes.values())
+        if longest <= max_length:
+            break
+        freq_table = {symbol: freq // 2 + 1 for symbol, freq in freq_table.items()}
+
+    for symbol, code in codes.items():
+        # a lone symbol still needs one bit per occurrence
+        lengths[symbol] = max(len(code), 1)
+    return lengths
+
+# assign canonical codes: shorter codes first, ties broken by symbol value
+def build_canonical_codes(lengths):
+    values = np.zeros(256, dtype=np.uint32)
+    code = 0
+    previous_length = 0
+    for symbol in sorted(np.flatnonzero(lengths).tolist(), key=lambda s: (lengths[s], s)):
+        length = int(lengths[symbol])
+        code <<= length - previous_length
+        values[symbol] = code
+        code += 1
+        previous_length = length
+    return values
+
+# render canonical codes as the bitstring dictionary stored in the file
+def codes_to_dict(values, lengths):
+    return {symbol: format(int(values[symbol]), f"0{lengths[symbol]}b") for symbol in np.flatnonzero(lengths).tolist()}
+
+# encode raw data with numpy: gather code and length per symbol and bit-pack them
+# output layout matches encode_data_reference: one padding byte, then the bits
+def encode_data(data, values, lengths):
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    packed, total_bits = pack_bits(values[symbols], lengths[symbols])
+
+    # add padding to make length divisible by 8 (a full byte when already aligned)
+    padding = 8 - total_bits % 8
+    compressed_bytes = bytearray([padding])
+    compressed_bytes += packed.tobytes()
+    if padding == 8:
+        compressed_bytes.append(0)
+    return compressed_bytes
+
+# reference encoder: builds the bitstring one character per bit
+def encode_data_reference(data, codes):
     bitstring = ''.join(codes[byte] for byte in data)
 
     # add padding to make length divisible by 8
@@ -71,8 +139,76 @@ def encode_data(data, codes):
 
     return compressed_bytes
 
-# decode bitstring back to original data
-def decode_data(compressed_bytes, codes):
+# build the decode lookup table for a code dictionary
+# every slot starting with a short code holds (length << 8) | symbol,
+# codes longer than the table go to a fallback dict keyed by (length, code)
+def build_decode_table(codes):
+    max_length = max(len(code) for code in codes.values())
+    table_bits = min(TABLE_BITS, max_length)
+    table = [0] * (1 << table_bits)
+    long_codes = {}
+
+    for symbol, code in codes.items():
+        length = len(code)
+        if length <= table_bits:
+            span = 1 << (table_bits - length)
+            start = int(code, 2) * span
+            table[start:start + span] = [(length << 8) | symbol] * span
+        else:
+            long_codes[(length, int(code, 2))] = symbol
+
+    return table, table_bits, long_codes, max_length
+
+# decode count symbols with a multi-bit lookup table
+# reads straight from the compressed buffer and fills a preallocated bytearray
+def decode_data(compressed_bytes, codes, count):
+    decoded = bytearray(count)
+    symbol, code = next(iter(codes.items()))
+    if len(codes) == 1 and not code:
+        # legacy files give a lone symbol an empty code
+        decoded[:] = bytes([symbol]) * count
+        return decoded
+
+    table, table_bits, long_codes, max_length = build_decode_table(codes)
+    data = memoryview(compressed_bytes)[1:]  # skip the padding byte
+    end = len(data)
+    needed = max(table_bits, max_length)
+    table_mask = (1 << table_bits) - 1
+
+    accumulator = 0
+    bits = 0
+    position = 0
+    for i in range(count):
+        # refill 56 bits at a time, missing bytes past the end read as zero
+        while bits < needed:
+            available = min(7, max(end - position, 0))
+            chunk = int.from_bytes(data[position:position + available], "big") << (8 * (7 - available))
+            accumulator = ((accumulator & ((1 << bits) - 1)) << 56) | chunk
+            bits += 56
+            position += 7
+
+        entry = table[(accumulator >> (bits - table_bits)) & table_mask]
+        if entry:
+            decoded[i] = entry & 0xFF
+            bits -= entry >> 8
+            continue
+
+        # fallback for codes longer than the table
+        length = table_bits
+        while True:
+            length += 1
+            if length > max_length:
+                raise ValueError("Invalid huffman code in compressed data")
+            key = (length, (accumulator >> (bits - length)) & ((1 << length) - 1))
+            if key in long_codes:
+                decoded[i] = long_codes[key]
+                bits -= length
+                break
+
+    return decoded
+
+# reference decoder: walks the bitstring one bit at a time
+def decode_data_reference(compressed_bytes, codes):
     inverse_codes = {v: k for k, v in codes.items()}
     bitstring = ''
     for byte in compressed_bytes:
@@ -90,51 +226,180 @@ def decode_data(compressed_bytes, codes):
             code = ''
     return decoded
 
-# compress an RGB image using huffman coding per channel
-def compress(input_image_path, output_path):
-    image = Image.open(input_image_path).convert("RGB")
-    r, g, b = image.split()
+# pack 256 code lengths (each at most 15) into 128 bytes, two per byte
+def pack_code_lengths(lengths):
+    return ((lengths[0::2] << 4) | lengths[1::2]).astype(np.uint8).tobytes()
 
-    channels = [r.tobytes(), g.tobytes(), b.tobytes()]
-    codes_list = []
-    compressed_data_list = []
+# unpack 128 bytes back into 256 code lengths
+def unpack_code_lengths(data):
+    packed = np.frombuffer(data, dtype=np.uint8)
+    lengths = np.empty(256, dtype=np.uint8)
+    lengths[0::2] = packed >> 4
+    lengths[1::2] = packed & 0x0F
+    return lengths
+
+# reject length tables that cannot form a prefix code
+def validate_code_lengths(lengths):
+    used = lengths[lengths > 0].astype(np.int64)
+    if used.size == 0 or np.sum(1 << (MAX_CODE_LENGTH - used)) > 1 << MAX_CODE_LENGTH:
+        raise ValueError("Invalid huffman code lengths in compressed data")
+
+# first payload byte of a tile in a file coded with a model (see compressors/models.py):
+# the index of the model table it uses, or OWN_TABLE for a tile that stores its own
+OWN_TABLE = 255
+
+# huffman-code one channel of one tile with its own code table,
+# stored as 128 bytes of canonical code lengths in front of the coded data
+# with a model the tile uses the model's cheapest table instead, unless even the entropy
+# bound of an own table beats it; then both are built and the smaller one is kept
+def encode_tile(data, model=None):
+    with profiling.stage("huffman.frequency_table", len(data)):
+        counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    if model is not None:
+        costs = model.tables.astype(np.int64) @ counts
+        best = int(np.argmin(costs))
+        present = counts[counts > 0]
+        bound = float(present @ np.log2(len(data) / present)) + 8 * 128
+        if costs[best] <= bound:
+            return bytes([best]) + encode_shared(data, model.values[best], model.tables[best])
+
+    with profiling.stage("huffman.code_lengths"):
+        lengths = build_code_lengths({symbol: int(counts[symbol]) for symbol in np.flatnonzero(counts).tolist()})
+    if model is not None and costs[best] <= int(lengths.astype(np.int64) @ counts) + 8 * 128:
+        return bytes([best]) + encode_shared(data, model.values[best], model.tables[best])
+    encoded = encode_shared(data, build_canonical_codes(lengths), lengths)
+    return (b"" if model is None else bytes([OWN_TABLE])) + pack_code_lengths(lengths) + encoded
+
+def encode_shared(data, values, lengths):
+    with profiling.stage("huffman.encode_data", len(data)) as stage:
+        encoded = encode_data(data, values, lengths)
+        stage.output(len(encoded))
+    return encoded
+
+# params hold the id of the model the file was coded with, or nothing when every tile has its own table;
+# the model is looked up in model_dir before the default search path
+def decode_tile(payload, count, params=b"", model_dir=None):
+    if params:
+        table, payload = payload[0], payload[1:]
+        if table != OWN_TABLE:
+            model = models.load(params, model_dir)
+            if table >= len(model.codes):
+                raise ValueError(f"Tile refers to table {table} of a model with {len(model.codes)}")
+            with profiling.stage("huffman.decode_data", len(payload)) as stage:
+                decoded = decode_data(payload, model.codes[table], count)
+                stage.output(count)
+            return decoded
+    lengths = unpack_code_lengths(payload[:128])
+    validate_code_lengths(lengths)
+    with profiling.stage("huffman.decode_data", len(payload)) as stage:
+        decoded = decode_data(payload[128:], codes_to_dict(build_canonical_codes(lengths), lengths), count)
+        stage.output(count)
+    return decoded
 
-    for channel in channels:
-        freq_table = build_frequency_table(channel)
-        tree = build_huffman_tree(freq_table)
-        codes = build_codes(tree)
-        compressed = encode_data(channel, codes)
+# tile encoder arguments and container parameters, with or without a model
+def tile_coder(model, model_dir=None):
+    if model is None:
+        return (), b""
+    model = models.resolve(model, model_dir)
+    return (model,), bytes.fromhex(model.id)
 
-        codes_list.append(codes)
-        compressed_data_list.append(compressed)
+# encode an (h, w, 3) uint8 array with huffman coding per channel, in the tiled container
+# color_transform and predictor select an optional reversible pre-transform;
+# every tile_size x tile_size tile and channel gets its own code table, unless model (a trained
+# model or its id, see compressors/models.py) has a shared table that codes it smaller;
+# model_dir is a directory (or list of them) to look the model id up in before the default search path;
+# with parallel=True the tiles are encoded in a process pool
+def encode(pixels, color_transform="none", predictor="none", tile_size=None, parallel=False, workers=None,
+           model=None, model_dir=None):
+    args, params = tile_coder(model, model_dir)
+    return container.encode(pixels, CONTAINER_ID, encode_tile, args, params, color_transform, predictor,
+                            tile_size, parallel, workers)
 
+# encode an image arriving as (rows, w, 3) uint8 row strips into the seekable file f, params as for encode
+# every tile has its own code table, so one row of tiles is coded and written at a time
+def encode_stream(image_strips, width, height, f, color_transform="none", predictor="none", tile_size=None,
+                  parallel=False, workers=None, model=None, model_dir=None):
+    args, params = tile_coder(model, model_dir)
+    container.encode_stream(image_strips, width, height, f, CONTAINER_ID, encode_tile, args, params, color_transform,
+                            predictor, tile_size, parallel, workers)
+
+# compress an RGB image using huffman coding per channel, params as for encode
+def compress(input_image_path, output_path, **params):
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+    data = encode(np.asarray(image), **params)
+    with profiling.stage("io.write_file", len(data)):
+        with open(output_path, "wb") as f:
+            f.write(data)
+
+# compress an image read in row strips, memory use does not grow with the image height
+def compress_stream(input_image_path, output_path, strip_rows=strips.STRIP_ROWS, **params):
+    width, height, image_strips = strips.read_strips(input_image_path, strip_rows)
     with open(output_path, "wb") as f:
-        # write image dimensions
-        f.write(struct.pack("II", image.width, image.height))
+        encode_stream(image_strips, width, height, f, **params)
+
+# read code tables and tile payloads stored with canonical code lengths
+def read_channels(f, tile_count):
+    codes_list = []
+    payloads = []
+    for _ in range(3):
+        lengths = unpack_code_lengths(f.read(128))
+        validate_code_lengths(lengths)
+        codes_list.append(codes_to_dict(build_canonical_codes(lengths), lengths))
+        for _ in range(tile_count):
+            compressed_length = struct.unpack("I", f.read(4))[0]
+            payloads.append(f.read(compressed_length))
+    return codes_list, payloads
 
-        for codes, compressed in zip(codes_list, compressed_data_list):
-            codes_pickle = pickle.dumps(codes)
-            f.write(struct.pack("I", len(codes_pickle)))     # length of pickle data
-            f.write(codes_pickle)                            # pickle data
-            f.write(struct.pack("I", len(compressed)))       # length of compressed bytes
-            f.write(compressed)                              # compressed byte data
+# read channels from files written before the versioned header
+# the code tables are pickled, so only open such files if we wrote them
+def read_legacy_channels(f, width, height):
+    channels = []
+    for _ in range(3):
+        codes_length = struct.unpack("I", f.read(4))[0]
+        codes = pickle.loads(f.read(codes_length))
+        compressed_length = struct.unpack("I", f.read(4))[0]
+        compressed_data = f.read(compressed_length)
+        channels.append(decode_data(compressed_data, codes, width * height))
+    return channels
+
+# decode huffman-coded bytes back into an (h, w, 3) uint8 array
+# with parallel=True the tiles are decoded in a process pool; model_dir as for encode
+def decode(data, parallel=False, workers=None, model_dir=None):
+    if data[:3] == container.MAGIC:
+        return container.decode(data, parallel, workers, CONTAINER_ID, (model_dir,))
+
+    with io.BytesIO(data) as f:
+        signature = f.read(4)
+        color_transform, predictor = "none", "none"
+        if signature[:3] == MAGIC:
+            version = signature[3]
+            if version not in (2, 3, 4):
+                raise ValueError(f"Unsupported huffman format version: {version}")
+            width, height = struct.unpack("II", f.read(8))
+            if version >= 3:
+                color_transform, predictor = transforms.unpack_flags(f.read(2))
+            tile_rows = struct.unpack("I", f.read(4))[0] if version >= 4 else height
+            ranges = tiles.tile_ranges(height, tile_rows)
+            codes_list, payloads = read_channels(f, len(ranges))
+        else:
+            # legacy files start directly with the image dimensions
+            width, height = struct.unpack("II", signature + f.read(4))
+            channels = read_legacy_channels(f, width, height)
+            payloads = None
+
+    if payloads is None:
+        pixels = np.stack([np.frombuffer(channel, dtype=np.uint8).reshape(height, width) for channel in channels], axis=2)
+    else:
+        tile_list = [(c, start, end) for c in range(3) for start, end in ranges]
+        args = [(codes_list[c], (end - start) * width) for c, start, end in tile_list]
+        pixels = tiles.decode_tiles(decode_data, (height, width, 3), tile_list, payloads, args, parallel, workers)
+
+    pixels = transforms.inverse(pixels, color_transform, predictor)
+    return np.ascontiguousarray(pixels)
 
 # decompress a huffman-coded RGB image
-def decompress(input_path, output_image_path):
-    with open(input_path, "rb") as f:
-        width, height = struct.unpack("II", f.read(8))
-        channels = []
-
-        for _ in range(3):
-            codes_length = struct.unpack("I", f.read(4))[0]
-            codes = pickle.loads(f.read(codes_length))
-            compressed_length = struct.unpack("I", f.read(4))[0]
-            compressed_data = f.read(compressed_length)
-            decompressed = decode_data(compressed_data, codes)
-            channels.append(bytes(decompressed))
-
-    r = Image.frombytes("L", (width, height), channels[0])
-    g = Image.frombytes("L", (width, height), channels[1])
-    b = Image.frombytes("L", (width, height), channels[2])
-    image = Image.merge("RGB", (r, g, b))
-    image.save(output_image_path)
+def decompress(input_path, output_image_path, **options):
+    pixels = decode(container.map_file(input_path), **options)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path)
@@ -1,9 +1,51 @@
+import io
+import numpy as np
+import PIL
 from PIL import Image
 
+from compressors import profiling
+
+# encoder output depends on the Pillow (libjpeg) build
+LIBRARY_VERSION = f"Pillow {PIL.__version__}"
+
+# encode an (h, w, 3) uint8 array as JPEG in memory
+def encode(pixels, quality=75):
+    return encode_image(Image.fromarray(pixels, "RGB"), quality)
+
+# encode an RGB PIL image as JPEG in memory, lets callers trying many qualities convert the pixels once
+# an optimized save needs the whole file to fit in a buffer Pillow sizes by guessing (one byte per
+# pixel below quality 95), detailed images at high qualities overflow it and libjpeg fails with
+# "Suspension not allowed here"; those are written again without optimized Huffman tables
+def encode_image(image, quality=75):
+    with profiling.stage("jpeg.encode", image.width * image.height * len(image.getbands())) as stage:
+        try:
+            data = save_image(image, quality, optimize=True)
+        except OSError:
+            data = save_image(image, quality, optimize=False)
+        stage.output(len(data))
+        return data
+
+def save_image(image, quality, optimize):
+    with io.BytesIO() as f:
+        image.save(f, format="JPEG", quality=quality, subsampling=0, optimize=optimize)
+        return f.getvalue()
+
+# decode JPEG bytes back into an (h, w, 3) uint8 array
+def decode(data):
+    with profiling.stage("jpeg.decode", len(data)), io.BytesIO(data) as f:
+        return np.asarray(Image.open(f).convert("RGB"))
+
 def compress(input_image_path, output_path, quality=75):
-    image = Image.open(input_image_path).convert("RGB")
-    image.save(output_path, format="JPEG", quality=quality, subsampling=0, optimize=True)
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+    data = encode(np.asarray(image), quality)
+    with profiling.stage("io.write_file", len(data)):
+        with open(output_path, "wb") as f:
+            f.write(data)
 
 def decompress(input_path, output_image_path):
-    image = Image.open(input_path).convert("RGB")
-    image.save(output_image_path, format="PNG")
+    with profiling.stage("io.read_file"), open(input_path, "rb") as f:
+        data = f.read()
+    pixels = decode(data)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path, format="PNG")
@@ -1,17 +1,112 @@
 from PIL import Image
 import numpy as np
 import glymur
+import os
+import tempfile
 
-def compress(input_image_path, output_path, compression_ratio=10):
-    image = Image.open(input_image_path).convert("RGB")
-    image_np = np.array(image)
+from compressors import profiling
+
+# encoder output depends on the glymur and OpenJPEG builds
+LIBRARY_VERSION = f"glymur {glymur.__version__} openjpeg {glymur.version.openjpeg_version}"
+
+# packet orders OpenJPEG can write: L(ayer), R(esolution), C(omponent), P(osition)
+# resolution-first orders put the whole low-resolution image at the start of the codestream
+PROGRESSIONS = ["LRCP", "RLCP", "RPCL", "PCRL", "CPRL"]
+
+# OpenJPEG's default number of resolution levels
+DEFAULT_RESOLUTIONS = 6
+
+# glymur keyword arguments for an (h, w) image
+# compression_ratio is one ratio, or a list of decreasing ratios with one quality layer each;
+# tile_size splits the codestream into independently decodable square tiles,
+# resolutions is the number of resolution levels (wavelet decompositions + 1)
+def encode_options(shape, compression_ratio=10, tile_size=None, resolutions=None, progression=None):
+    ratios = list(compression_ratio) if isinstance(compression_ratio, (list, tuple)) else [compression_ratio]
+    if ratios != sorted(ratios, reverse=True):
+        raise ValueError(f"Layer compression ratios must decrease, got {ratios}")
+    options = {"cratios": ratios}
+    smallest = min(shape[:2])
+    if tile_size:
+        tile = (min(tile_size, shape[0]), min(tile_size, shape[1]))
+        options["tilesize"] = tile
+        smallest = min(tile)
+    # every level halves the image, OpenJPEG rejects more levels than the smallest tile side allows
+    levels = resolutions or DEFAULT_RESOLUTIONS
+    options["numres"] = max(1, min(levels, smallest.bit_length()))
+    if progression:
+        if progression not in PROGRESSIONS:
+            raise ValueError(f"Unknown progression order: {progression}")
+        options["prog"] = progression
+    return options
+
+# glymur only reads and writes files, so the in-memory API goes through a temporary file
+def encode(pixels, compression_ratio=10, tile_size=None, resolutions=None, progression=None):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.jp2")
+        with profiling.stage("jpeg2000.encode", pixels.nbytes):
+            glymur.Jp2k(path, data=pixels,
+                        **encode_options(pixels.shape, compression_ratio, tile_size, resolutions, progression))
+        with open(path, "rb") as f:
+            return f.read()
+
+# decode JPEG 2000 bytes into an (h, w, 3) uint8 array, options as for read_pixels
+def decode(data, reduce=0, region=None):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.jp2")
+        with open(path, "wb") as f:
+            f.write(data)
+        return read_pixels(path, reduce, region)
+
+# decode a JPEG 2000 file into an (h, w, 3) uint8 array
+# reduce skips that many resolution levels (each halves the size) and region = (x, y, width, height)
+# in full-resolution pixels decodes only a window; OpenJPEG then only decodes the code blocks
+# that contribute to the output, so previews and crops cost a fraction of a full decode
+def read_pixels(path, reduce=0, region=None):
+    jp2 = glymur.Jp2k(path)
+    height, width = jp2.shape[:2]
+    if not 0 <= reduce <= resolution_levels(jp2):
+        raise ValueError(f"Can reduce {path} by at most {resolution_levels(jp2)} levels, got {reduce}")
+    x, y, region_width, region_height = region or (0, 0, width, height)
+    if x < 0 or y < 0 or region_width <= 0 or region_height <= 0 \
+            or x + region_width > width or y + region_height > height:
+        raise ValueError(f"Region {region} is outside the {width}x{height} image")
+    step = 2 ** reduce
+    # glymur maps a power-of-two step to rlevel and the slice bounds to the decode area
+    with profiling.stage("jpeg2000.decode"):
+        if region is None:
+            image_data = jp2[::step, ::step] if reduce else jp2[:]
+        else:
+            image_data = jp2[y:y + region_height:step, x:x + region_width:step]
+    return np.asarray(Image.fromarray(image_data).convert("RGB"))
+
+# number of times the resolution of a JPEG 2000 file can be halved on decode, the wavelet
+# decompositions glymur reports as the COD num_res: one less than the resolutions it was encoded with
+def resolution_levels(jp2):
+    cod = next(segment for segment in jp2.codestream.segment if segment.marker_id == "COD")
+    return cod.num_res
+
+# lowest resolution of a file that is still at least size = (width, height), for thumbnails
+def read_preview(path, size):
+    jp2 = glymur.Jp2k(path)
+    height, width = jp2.shape[:2]
+    reduce = 0
+    while reduce < resolution_levels(jp2) and width >> (reduce + 1) >= size[0] and height >> (reduce + 1) >= size[1]:
+        reduce += 1
+    return read_pixels(path, reduce)
+
+def compress(input_image_path, output_path, compression_ratio=10, tile_size=None, resolutions=None,
+             progression=None):
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+        image_np = np.array(image)
 
     # lossy compression with selected compression ratio
-    glymur.Jp2k(output_path, data=image_np, cratios=[compression_ratio])
-
-def decompress(input_path, output_image_path):
-    jp2 = glymur.Jp2k(input_path)
-    image_data = jp2[:]
-    image = Image.fromarray(image_data)
-    image = image.convert("RGB")
-    image.save(output_image_path, format="PNG")
+    with profiling.stage("jpeg2000.encode", image_np.nbytes):
+        glymur.Jp2k(output_path, data=image_np,
+                    **encode_options(image_np.shape, compression_ratio, tile_size, resolutions, progression))
+
+# decompress a JPEG 2000 file, optionally at reduced resolution or only a region (see read_pixels)
+def decompress(input_path, output_image_path, reduce=0, region=None):
+    pixels = read_pixels(input_path, reduce, region)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path, format="PNG")
@@ -1,93 +1,374 @@
+import io
 import os
-from collections import defaultdict
 from PIL import Image
+import numpy as np
 import struct
+from compressors.bitpack import pack_bits
+from compressors import transforms, tiles, container, strips, profiling
 
-# compress an RGB image using LZW per channel
-def compress(input_image_path, output_path):
-    image = Image.open(input_image_path).convert("RGB")
-    r, g, b = image.split()
+# reserved codes of the packed mode (GIF/TIFF style)
+CLEAR_CODE = 256
+END_CODE = 257
+FIRST_CODE = 258
 
-    channels = [r.tobytes(), g.tobytes(), b.tobytes()]
-    compressed_channels = []
+# packed codes start at 9 bits and grow up to max_code_bits (at most 16)
+MIN_CODE_BITS = 9
+MAX_CODE_BITS = 16
 
-    for channel in channels:
-        compressed = lzw_compress(channel)
-        compressed_channels.append(compressed)
+# file signature followed by a format version byte
+# files without it are the legacy layout with 4 bytes per code
+# version 3 adds the pre-transform flags after the image dimensions,
+# version 4 the tile height after the code width limit, followed by one payload per tile;
+# version 5 packed files are written in the common tiled container (compressors/container.py)
+MAGIC = b"LZW"
+FORMAT_VERSION = 5
 
-    with open(output_path, "wb") as f:
-        f.write(struct.pack("II", image.width, image.height))
+# codec id in the tiled container
+CONTAINER_ID = 2
+
+# encode an (h, w, 3) uint8 array with LZW per channel
+# mode "packed" writes variable-width codes with a bounded dictionary into the tiled container,
+# mode "fixed" writes the legacy layout with 4-byte codes
+# color_transform and predictor select an optional reversible pre-transform (packed mode only);
+# packed channels are cut into independent tile_size x tile_size tiles,
+# with parallel=True channels and tiles are encoded in a process pool
+def encode(pixels, mode="packed", max_code_bits=MAX_CODE_BITS, color_transform="none", predictor="none",
+           tile_size=None, parallel=False, workers=None):
+    if mode not in ("packed", "fixed"):
+        raise ValueError(f"Unknown LZW mode: {mode}")
+    if not MIN_CODE_BITS <= max_code_bits <= MAX_CODE_BITS:
+        raise ValueError(f"max_code_bits must be between {MIN_CODE_BITS} and {MAX_CODE_BITS}")
+    if mode == "fixed" and (color_transform, predictor) != ("none", "none"):
+        raise ValueError("The fixed LZW mode has no room for pre-transform flags")
+
+    if mode == "packed":
+        return container.encode(pixels, CONTAINER_ID, lzw_compress_packed, (max_code_bits,), bytes([max_code_bits]),
+                                color_transform, predictor, tile_size, parallel, workers)
 
-        for compressed in compressed_channels:
+    height, width = pixels.shape[:2]
+    planes = np.ascontiguousarray(pixels.transpose(2, 0, 1))
+    tile_list = [(c, 0, height) for c in range(3)]
+    compressed_tiles = tiles.encode_tiles(lzw_compress, planes, tile_list, [()] * 3, parallel, workers)
+
+    with io.BytesIO() as f:
+        f.write(struct.pack("II", width, height))
+        for compressed in compressed_tiles:
             f.write(struct.pack("I", len(compressed)))
             f.write(bytes(compressed))
+        return f.getvalue()
 
-# cecompress LZW-compressed RGB image
-def decompress(input_path, output_image_path):
-    with open(input_path, "rb") as f:
-        width, height = struct.unpack("II", f.read(8))
-        channels = []
+# encode an image arriving as (rows, w, 3) uint8 row strips into the seekable file f, packed mode only, params as for encode
+def encode_stream(image_strips, width, height, f, max_code_bits=MAX_CODE_BITS, color_transform="none", predictor="none",
+                  tile_size=None, parallel=False, workers=None):
+    if not MIN_CODE_BITS <= max_code_bits <= MAX_CODE_BITS:
+        raise ValueError(f"max_code_bits must be between {MIN_CODE_BITS} and {MAX_CODE_BITS}")
+    container.encode_stream(image_strips, width, height, f, CONTAINER_ID, lzw_compress_packed, (max_code_bits,),
+                            bytes([max_code_bits]), color_transform, predictor, tile_size, parallel, workers)
+
+# decode one packed channel tile of the tiled container, params hold the code width limit
+def decode_tile(payload, count, params):
+    return lzw_decompress_packed(payload, count, params[0])
 
-        for _ in range(3):
+# compress an RGB image using LZW per channel, params as for encode
+def compress(input_image_path, output_path, **params):
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+    data = encode(np.asarray(image), **params)
+    with profiling.stage("io.write_file", len(data)):
+        with open(output_path, "wb") as f:
+            f.write(data)
+
+# compress an image read in row strips, memory use does not grow with the image height
+def compress_stream(input_image_path, output_path, strip_rows=strips.STRIP_ROWS, **params):
+    width, height, image_strips = strips.read_strips(input_image_path, strip_rows)
+    with open(output_path, "wb") as f:
+        encode_stream(image_strips, width, height, f, **params)
+
+# decode LZW-compressed bytes back into an (h, w, 3) uint8 array
+# with parallel=True the tiles are decoded in a process pool
+def decode(data, parallel=False, workers=None):
+    if data[:3] == container.MAGIC:
+        return container.decode(data, parallel, workers, CONTAINER_ID)
+
+    with io.BytesIO(data) as f:
+        signature = f.read(4)
+        color_transform, predictor = "none", "none"
+        if signature[:3] == MAGIC:
+            version = signature[3]
+            if version not in (2, 3, 4):
+                raise ValueError(f"Unsupported LZW format version: {version}")
+            width, height = struct.unpack("II", f.read(8))
+            if version >= 3:
+                color_transform, predictor = transforms.unpack_flags(f.read(2))
+            max_code_bits = struct.unpack("B", f.read(1))[0]
+            tile_rows = struct.unpack("I", f.read(4))[0] if version >= 4 else height
+        else:
+            # legacy files start directly with the image dimensions
+            width, height = struct.unpack("II", signature + f.read(4))
+            max_code_bits = None
+            tile_rows = height
+
+        tile_list = [(c, start, end) for c in range(3) for start, end in tiles.tile_ranges(height, tile_rows)]
+        payloads = []
+        for _ in tile_list:
             length = struct.unpack("I", f.read(4))[0]
-            compressed = list(f.read(length))
-            decompressed = lzw_decompress(compressed)
-            channels.append(bytes(decompressed))
+            payloads.append(f.read(length))
+
+    if max_code_bits is None:
+        function = lzw_decompress
+        args = [((end - start) * width,) for _, start, end in tile_list]
+    else:
+        function = lzw_decompress_packed
+        args = [((end - start) * width, max_code_bits) for _, start, end in tile_list]
+    pixels = tiles.decode_tiles(function, (height, width, 3), tile_list, payloads, args, parallel, workers)
+
+    pixels = transforms.inverse(pixels, color_transform, predictor)
+    return np.ascontiguousarray(pixels)
+
+# cecompress LZW-compressed RGB image
+def decompress(input_path, output_image_path, **options):
+    pixels = decode(container.map_file(input_path), **options)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path)
+
+# LZW dictionary loop shared by both modes
+# entries are keyed by (prefix_code << 8) | next_byte, single bytes are implicit codes
+# with max_codes set, a CLEAR code is emitted and the dictionary reset once it is full
+def lzw_encode(uncompressed, first_code=256, max_codes=None):
+    codes = []
+    if not uncompressed:
+        return codes
+
+    dictionary = {}
+    next_code = first_code
+    data = iter(uncompressed)
+    w = next(data)
+
+    for c in data:
+        key = (w << 8) | c
+        code = dictionary.get(key)
+        if code is not None:
+            w = code
+            continue
+
+        codes.append(w)
+        if next_code == max_codes:
+            codes.append(CLEAR_CODE)
+            dictionary.clear()
+            next_code = first_code
+        else:
+            dictionary[key] = next_code
+            next_code += 1
+        w = c
 
-    r = Image.frombytes("L", (width, height), channels[0])
-    g = Image.frombytes("L", (width, height), channels[1])
-    b = Image.frombytes("L", (width, height), channels[2])
-    image = Image.merge("RGB", (r, g, b))
-    image.save(output_image_path)
+    codes.append(w)
+    return codes
 
-# LZW compression algorithm
+# LZW decoding into a preallocated output buffer
+# a dictionary entry is always a copy of earlier output, so it is stored as
+# (start, length) in the output and expanded with one slice copy
+def lzw_decode(codes, count, first_code=256, max_codes=None):
+    out = bytearray(count)
+    entry_starts = []
+    entry_lengths = []
+    previous_start = -1
+    previous_length = 0
+    position = 0
+
+    for k in codes:
+        if k < 256:
+            if position >= count:
+                raise ValueError("LZW data decodes past the image size")
+            out[position] = k
+            length = 1
+        elif k == CLEAR_CODE and max_codes is not None:
+            entry_starts.clear()
+            entry_lengths.clear()
+            previous_start = -1
+            continue
+        else:
+            index = k - first_code
+            if 0 <= index < len(entry_starts):
+                start = entry_starts[index]
+                length = entry_lengths[index]
+                if position + length > count:
+                    raise ValueError("LZW data decodes past the image size")
+                out[position:position + length] = out[start:start + length]
+            elif index == len(entry_starts) and previous_start >= 0:
+                # code defined by this very step: previous entry plus its first byte
+                length = previous_length + 1
+                if position + length > count:
+                    raise ValueError("LZW data decodes past the image size")
+                out[position:position + previous_length] = out[previous_start:previous_start + previous_length]
+                out[position + previous_length] = out[previous_start]
+            else:
+                raise ValueError("Bad compressed k: %s" % k)
+
+        # new entry is the previous string plus this one's first byte, already contiguous in out
+        if previous_start >= 0 and (max_codes is None or first_code + len(entry_starts) < max_codes):
+            entry_starts.append(previous_start)
+            entry_lengths.append(previous_length + 1)
+        previous_start = position
+        previous_length = length
+        position += length
+
+    if position != count:
+        raise ValueError("LZW data does not match the image size")
+    return out
+
+# LZW compression algorithm, 4 bytes per code
 def lzw_compress(uncompressed):
-    dict_size = 256
-    dictionary = {bytes([i]): i for i in range(dict_size)}
+    return np.array(lzw_encode(uncompressed), dtype=np.uint32).tobytes()
+
+# LZW decompression algorithm, 4 bytes per code
+def lzw_decompress(compressed_bytes, count):
+    codes = np.frombuffer(compressed_bytes, dtype=np.uint32).tolist()
+    return lzw_decode(codes, count)
+
+# bit width of every code in one dictionary cycle, as the decoder will read them
+# a cycle holds one code per dictionary size from FIRST_CODE to max_codes, then CLEAR
+def cycle_code_widths(max_code_bits):
+    cycle = np.arange((1 << max_code_bits) - FIRST_CODE + 2) + FIRST_CODE - 1
+    bit_lengths = np.searchsorted(1 << np.arange(MAX_CODE_BITS + 2), cycle, side="right")
+    return np.clip(bit_lengths, MIN_CODE_BITS, max_code_bits)
+
+# LZW compression with variable-width codes and a bounded dictionary
+# a CLEAR code resets the dictionary once it holds 2**max_code_bits entries
+def lzw_compress_packed(uncompressed, max_code_bits=MAX_CODE_BITS):
+    with profiling.stage("lzw.dictionary", len(uncompressed)):
+        codes = lzw_encode(uncompressed, FIRST_CODE, 1 << max_code_bits)
+    codes.append(END_CODE)
+
+    # every cycle but the last is complete, so widths repeat with the cycle length
+    with profiling.stage("lzw.pack_codes") as stage:
+        widths = np.resize(cycle_code_widths(max_code_bits), len(codes))
+        packed, _ = pack_bits(codes, widths)
+        stage.output(packed.nbytes)
+    return packed.tobytes()
+
+# read every variable-width code up to the END code
+def unpack_codes(compressed_bytes, max_code_bits=MAX_CODE_BITS):
+    cycle_widths = cycle_code_widths(max_code_bits)
+    total_bits = len(compressed_bytes) * 8
+    cycles = total_bits // int(cycle_widths.sum()) + 1
 
+    # no code is shorter than MIN_CODE_BITS, which bounds how many can fit
+    widths = np.tile(cycle_widths, cycles)[:total_bits // MIN_CODE_BITS + 1]
+    ends = np.cumsum(widths)
+    widths = widths[ends <= total_bits]
+    starts = ends[:len(widths)] - widths
+
+    # each code (at most 16 bits) lies inside the 3 bytes starting at its first byte
+    data = np.zeros(len(compressed_bytes) + 2, dtype=np.uint32)
+    data[:len(compressed_bytes)] = np.frombuffer(compressed_bytes, dtype=np.uint8)
+    first = starts >> 3
+    windows = (data[first] << 16) | (data[first + 1] << 8) | data[first + 2]
+    codes = (windows >> (24 - (starts & 7) - widths)) & ((1 << widths) - 1)
+
+    end = np.flatnonzero(codes == END_CODE)
+    if not len(end):
+        raise ValueError("Truncated LZW data")
+    # iterating a uint16 memoryview yields ints without building a list of them
+    return memoryview(codes[:end[0]].astype(np.uint16))
+
+# LZW decompression of variable-width codes, mirrors lzw_compress_packed
+def lzw_decompress_packed(compressed_bytes, count, max_code_bits=MAX_CODE_BITS):
+    with profiling.stage("lzw.unpack_codes", len(compressed_bytes)):
+        codes = unpack_codes(compressed_bytes, max_code_bits)
+    with profiling.stage("lzw.dictionary_decode") as stage:
+        stage.output(count)
+        return lzw_decode(codes, count, FIRST_CODE, 1 << max_code_bits)
+
+# width of the next code as the reference decoder will see it
+# next_code is the number of dictionary entries the decoder holds at that point
+def code_width(next_code, max_code_bits):
+    return min(max(next_code.bit_length(), MIN_CODE_BITS), max_code_bits)
+
+# reference encoder: the packed mode before the integer-keyed dictionary, builds a bytes
+# object per pixel and one code width per code; same output as lzw_compress_packed
+def lzw_compress_packed_reference(uncompressed, max_code_bits=MAX_CODE_BITS):
+    max_codes = 1 << max_code_bits
+    dictionary = {bytes([i]): i for i in range(256)}
+    next_code = FIRST_CODE
+
+    codes = []
+    widths = []
     w = b""
-    result = []
 
     for c in uncompressed:
         wc = w + bytes([c])
         if wc in dictionary:
             w = wc
+            continue
+
+        # the decoder adds its entry for the previous code only after reading this one
+        codes.append(dictionary[w])
+        widths.append(code_width(next_code - 1, max_code_bits))
+
+        if next_code < max_codes:
+            dictionary[wc] = next_code
+            next_code += 1
         else:
-            result.append(dictionary[w])
-            dictionary[wc] = dict_size
-            dict_size += 1
-            w = bytes([c])
+            codes.append(CLEAR_CODE)
+            widths.append(code_width(next_code, max_code_bits))
+            dictionary = {bytes([i]): i for i in range(256)}
+            next_code = FIRST_CODE
+        w = bytes([c])
 
     if w:
-        result.append(dictionary[w])
+        codes.append(dictionary[w])
+        widths.append(code_width(next_code - 1, max_code_bits))
+    codes.append(END_CODE)
+    widths.append(code_width(next_code, max_code_bits))
+
+    packed, _ = pack_bits(codes, widths)
+    return packed.tobytes()
+
+# reference decoder: reads one code at a time through a bit accumulator and
+# concatenates bytes entries, mirrors lzw_compress_packed_reference
+def lzw_decompress_packed_reference(compressed_bytes, max_code_bits=MAX_CODE_BITS):
+    max_codes = 1 << max_code_bits
+    dictionary = {i: bytes([i]) for i in range(256)}
+    next_code = FIRST_CODE
 
-    # convert codes to byte stream (4 bytes per code)
-    output_bytes = []
-    for code in result:
-        output_bytes.extend(struct.pack("I", code))  # 4 bytes per code
-    return output_bytes
+    result = bytearray()
+    w = None
 
-# LZW decompression algorithm
-def lzw_decompress(compressed_bytes):
-    dict_size = 256
-    dictionary = {i: bytes([i]) for i in range(dict_size)}
+    accumulator = 0
+    bits = 0
+    position = 0
 
-    compressed = [struct.unpack("I", bytes(compressed_bytes[i:i+4]))[0] for i in range(0, len(compressed_bytes), 4)]
+    while True:
+        width = code_width(next_code, max_code_bits)
+        while bits < width:
+            if position >= len(compressed_bytes):
+                raise ValueError("Truncated LZW data")
+            accumulator = (accumulator << 8) | compressed_bytes[position]
+            position += 1
+            bits += 8
+        bits -= width
+        k = accumulator >> bits
+        accumulator &= (1 << bits) - 1
 
-    w = bytes([compressed.pop(0)])
-    result = bytearray(w)
+        if k == CLEAR_CODE:
+            dictionary = {i: bytes([i]) for i in range(256)}
+            next_code = FIRST_CODE
+            w = None
+            continue
+        if k == END_CODE:
+            break
 
-    for k in compressed:
         if k in dictionary:
             entry = dictionary[k]
-        elif k == dict_size:
-            entry = w + bytes([w[0]])
+        elif k == next_code and w is not None:
+            entry = w + w[:1]
         else:
             raise ValueError("Bad compressed k: %s" % k)
 
         result.extend(entry)
-        dictionary[dict_size] = w + bytes([entry[0]])
-        dict_size += 1
+        if w is not None and next_code < max_codes:
+            dictionary[next_code] = w + entry[:1]
+            next_code += 1
         w = entry
 
     return result
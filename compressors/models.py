@@ -0,0 +1,205 @@
+import os
+import struct
+import hashlib
+import threading
+import numpy as np
+from compressors import transforms, container, huffman
+
+# shared codebooks for batches of similar images: Huffman code tables and a zlib preset
+# dictionary, trained on a sample corpus and referenced from a container header by id
+# instead of building and storing a table per tile
+#
+#   file   signature, version, model id, transform flags the corpus was trained with,
+#          number of Huffman tables, 128 bytes of packed code lengths per table,
+#          dictionary length, dictionary
+#
+# the id is a hash of everything after it, so a file can only ever hold one model
+#
+# shared Huffman tables only pay off on prediction residuals (train and encode with a predictor,
+# e.g. ycocg-r + med): raw pixel histograms differ too much between tiles, so without a
+# pre-transform every tile falls back to a table of its own and the model just costs a flag byte
+MAGIC = b"ICM"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<3sB8s2sB")
+
+# directory models are saved to by default and looked up in last, models/ next to the
+# compressors package whatever the working directory
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+EXTENSION = ".icm"
+
+# environment variable with more directories to look models up in (os.pathsep separated),
+# searched before MODEL_DIR; worker processes inherit it, so it also reaches parallel decodes
+MODEL_PATH_ENV = "ICM_MODEL_PATH"
+
+# zlib only looks back 32 KiB, a longer dictionary would never be reached
+MAX_DICT_SIZE = 1 << 15
+
+# the dictionary is made of pieces of the training tiles this long; on test_images crops and
+# synthetic images they beat both shorter pieces and the most frequent 8-byte substrings
+DICT_CHUNK = 2048
+
+# training reads at most this many bytes of tile data for the dictionary
+SAMPLE_BYTES = 1 << 22
+
+# models by id, loaded once per process
+LOADED = {}
+LOADED_LOCK = threading.Lock()
+
+# tables is a (k, 256) array of Huffman code lengths, one table per channel when trained;
+# every table codes all 256 byte values, so any tile can use any table
+class Model:
+    def __init__(self, tables, zdict, color_transform="none", predictor="none"):
+        self.tables = np.asarray(tables, dtype=np.uint8).reshape(-1, 256)
+        if not 1 <= len(self.tables) < 255:
+            raise ValueError(f"A model holds 1 to 254 Huffman tables, got {len(self.tables)}")
+        for lengths in self.tables:
+            huffman.validate_code_lengths(lengths)
+            if not lengths.all():
+                raise ValueError("Model Huffman tables must code every byte value")
+        if len(zdict) > MAX_DICT_SIZE:
+            raise ValueError(f"Preset dictionary of {len(zdict)} bytes is longer than {MAX_DICT_SIZE}")
+        self.zdict = bytes(zdict)
+        self.color_transform = color_transform
+        self.predictor = predictor
+        # canonical codes in both forms the huffman coder takes, built once for all tiles
+        self.values = np.array([huffman.build_canonical_codes(lengths) for lengths in self.tables])
+        self.codes = [huffman.codes_to_dict(values, lengths) for values, lengths in zip(self.values, self.tables)]
+        self.id = hashlib.blake2b(self.body(), digest_size=8).hexdigest()
+
+    # everything the id covers
+    def body(self):
+        return (transforms.pack_flags(self.color_transform, self.predictor) + bytes([len(self.tables)])
+                + b"".join(huffman.pack_code_lengths(lengths) for lengths in self.tables)
+                + struct.pack("<I", len(self.zdict)) + self.zdict)
+
+    def to_bytes(self):
+        return MAGIC + bytes([FORMAT_VERSION]) + bytes.fromhex(self.id) + self.body()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size or data[:3] != MAGIC:
+            raise ValueError("Not a codebook model")
+        _, version, model_id, flags, count = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model version: {version}")
+        color_transform, predictor = transforms.unpack_flags(flags)
+        offset = HEADER.size + 128 * count
+        if len(data) < offset + 4:
+            raise ValueError("Truncated codebook model")
+        tables = [huffman.unpack_code_lengths(data[start:start + 128]) for start in range(HEADER.size, offset, 128)]
+        zdict_length = struct.unpack_from("<I", data, offset)[0]
+        zdict = data[offset + 4:offset + 4 + zdict_length]
+        if len(zdict) != zdict_length:
+            raise ValueError("Truncated codebook model")
+        model = cls(tables, zdict, color_transform, predictor)
+        if model.id != model_id.hex():
+            raise ValueError("Codebook model checksum mismatch")
+        return model
+
+    def describe(self):
+        return (f"model {self.id}: {self.color_transform}/{self.predictor}, {len(self.tables)} Huffman tables of "
+                f"{int(self.tables.min())}-{int(self.tables.max())} bit codes, {len(self.zdict)} byte dictionary")
+
+def model_path(model_id, directory=None):
+    return os.path.join(directory or MODEL_DIR, model_id + EXTENSION)
+
+# directories a model is looked up in: directory (one path or a list of them), then the
+# entries of MODEL_PATH_ENV, then MODEL_DIR
+def search_path(directory=None):
+    if directory is None:
+        directories = []
+    elif isinstance(directory, (str, os.PathLike)):
+        directories = [directory]
+    else:
+        directories = list(directory)
+    directories += [entry for entry in os.environ.get(MODEL_PATH_ENV, "").split(os.pathsep) if entry]
+    return directories + [MODEL_DIR]
+
+# write a model into directory as <id>.icm, returns the path
+# the model is also kept like a loaded one, so files coded with it decode in this process right away
+def save(model, directory=None):
+    path = model_path(model.id, directory)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(model.to_bytes())
+    os.replace(path + ".tmp", path)
+    with LOADED_LOCK:
+        LOADED.setdefault(model.id, model)
+    return path
+
+# model by id (a hex string or the 8 id bytes of a container header), read from the first
+# directory of search_path(directory) that has it and kept for later calls, so decoding many
+# files pays for it only once
+def load(model_id, directory=None):
+    if not isinstance(model_id, str):
+        model_id = bytes(model_id).hex()
+    model = LOADED.get(model_id)
+    if model is None:
+        with LOADED_LOCK:
+            model = LOADED.get(model_id)
+            if model is None:
+                directories = search_path(directory)
+                for candidate in directories:
+                    try:
+                        with open(model_path(model_id, candidate), "rb") as f:
+                            model = Model.from_bytes(f.read())
+                        break
+                    except FileNotFoundError:
+                        pass
+                else:
+                    raise ValueError(f"Codebook model {model_id} not found in {os.pathsep.join(map(str, directories))}")
+                if model.id != model_id:
+                    raise ValueError(f"File for model {model_id} holds model {model.id}")
+                LOADED[model_id] = model
+    return model
+
+# a Model for an id, a Model stays as it is
+def resolve(model, directory=None):
+    return model if isinstance(model, Model) else load(model, directory)
+
+# every channel of every container tile, after the pre-transform the codecs would apply
+def tile_channels(pixels, color_transform, predictor, tile_size=None):
+    tile_size = tile_size or container.TILE_SIZE
+    height, width = pixels.shape[:2]
+    for y0, y1, x0, x1 in container.tile_grid(width, height, tile_size, tile_size):
+        planes = transforms.forward(pixels[y0:y1, x0:x1], color_transform, predictor)
+        for c in range(3):
+            yield np.ascontiguousarray(planes[:, :, c]).reshape(-1)
+
+# at most size bytes of DICT_CHUNK-long pieces spread evenly over the samples (flat uint8 arrays)
+def build_zdict(samples, size=MAX_DICT_SIZE):
+    samples = [sample for sample in samples if len(sample)]
+    if not samples or not size:
+        return b""
+    per_sample = -(-size // (DICT_CHUNK * len(samples)))
+    pieces = []
+    for sample in samples:
+        chunk = min(DICT_CHUNK, len(sample))
+        for start in np.unique(np.linspace(0, len(sample) - chunk, per_sample).astype(int)).tolist():
+            pieces.append(sample[start:start + chunk].tobytes())
+    return b"".join(pieces)[-size:]
+
+# train a model on an iterable of (h, w, 3) uint8 arrays
+# every channel gets a Huffman table from its summed byte histogram (every byte value keeps
+# a code, so images unlike the corpus still encode), the dictionary comes from a sample of the tiles
+def train(images, color_transform="none", predictor="none", dict_size=MAX_DICT_SIZE, tile_size=None):
+    transforms.validate(color_transform, predictor)
+    if not 0 <= dict_size <= MAX_DICT_SIZE:
+        raise ValueError(f"dict_size must be between 0 and {MAX_DICT_SIZE}")
+    counts = np.ones((3, 256), dtype=np.int64)
+    channels = []
+    for pixels in images:
+        for index, channel in enumerate(tile_channels(np.asarray(pixels), color_transform, predictor, tile_size)):
+            counts[index % 3] += np.bincount(channel, minlength=256)
+            channels.append(channel)
+    if not channels:
+        raise ValueError("No images to train on")
+
+    # an even spread of tile channels up to SAMPLE_BYTES
+    total = sum(len(channel) for channel in channels)
+    picks = max(1, len(channels) * SAMPLE_BYTES // total)
+    sample = [channels[i] for i in np.unique(np.linspace(0, len(channels) - 1, picks).astype(int)).tolist()]
+    zdict = build_zdict(sample, dict_size)
+
+    tables = [huffman.build_code_lengths(dict(enumerate(channel_counts.tolist()))) for channel_counts in counts]
+    return Model(tables, zdict, color_transform, predictor)
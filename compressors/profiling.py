@@ -0,0 +1,158 @@
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# named stage timings from inside the codecs
+#
+#   with profiling.Profile() as profile:
+#       codec.encode(pixels)
+#   print(profile.format())
+#
+# codecs wrap their steps in `with profiling.stage(name, bytes_in) as s: ... s.output(n)`;
+# while no profile is active, stage() hands back one shared no-op object, so an
+# instrumented call costs a global lookup and two empty method calls
+#
+# stages nest (a tile's huffman.encode_data runs inside container.encode_tiles), so their
+# times do not add up to the total; tiles encoded in worker processes (parallel=True)
+# are not seen, thread pools are
+
+# extra capture modes: cProfile of every function call, or tracemalloc allocation sizes per stage
+CAPTURES = ["cprofile", "tracemalloc"]
+
+# the profile stages are recorded into, None while profiling is off
+active = None
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def output(self, count):
+        pass
+
+NULL_STAGE = NullStage()
+
+# one timed run of a stage, recorded into its profile on exit
+class Stage:
+    __slots__ = ("profile", "name", "bytes_in", "bytes_out", "start", "blocks", "traced")
+
+    def __init__(self, profile, name, bytes_in):
+        self.profile = profile
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+
+    def __enter__(self):
+        self.traced = tracemalloc.get_traced_memory()[0] if self.profile.capture == "tracemalloc" else None
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        blocks = sys.getallocatedblocks() - self.blocks
+        traced = tracemalloc.get_traced_memory()[0] - self.traced if self.traced is not None else None
+        self.profile.record(self.name, elapsed, self.bytes_in, self.bytes_out, blocks, traced)
+        return False
+
+    # bytes the stage produced
+    def output(self, count):
+        self.bytes_out = count
+
+# timed stage named name for the active profile, a no-op while profiling is off
+def stage(name, bytes_in=None):
+    profile = active
+    if profile is None:
+        return NULL_STAGE
+    return Stage(profile, name, bytes_in)
+
+# totals per stage name, in the order stages first ran
+# allocated_blocks is the change in live Python objects (sys.getallocatedblocks), traced_kb the
+# change in traced memory with the tracemalloc capture; both are net of frees inside the stage
+# and include other threads, they show where objects pile up rather than exact counts
+class Profile:
+    def __init__(self, capture=None):
+        if capture is not None and capture not in CAPTURES:
+            raise ValueError(f"Unknown capture mode: {capture}")
+        self.capture = capture
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.started_tracing = False
+
+    def __enter__(self):
+        global active
+        if active is not None:
+            raise RuntimeError("Another profile is already active")
+        if self.capture == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        if self.capture == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        active = self
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        active = None
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return False
+
+    def record(self, name, elapsed_ns, bytes_in, bytes_out, blocks, traced):
+        with self.lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = {"calls": 0, "ns": 0, "bytes_in": 0, "bytes_out": 0, "blocks": 0,
+                                              "traced": 0}
+            totals["calls"] += 1
+            totals["ns"] += elapsed_ns
+            totals["bytes_in"] += bytes_in or 0
+            totals["bytes_out"] += bytes_out or 0
+            totals["blocks"] += blocks
+            totals["traced"] += traced or 0
+
+    # one dict per stage: stage, calls, ms, bytes_in, bytes_out, allocated_blocks (and traced_kb)
+    def rows(self):
+        with self.lock:
+            stages = [(name, dict(totals)) for name, totals in self.stages.items()]
+        rows = []
+        for name, totals in stages:
+            row = {"stage": name, "calls": totals["calls"], "ms": totals["ns"] / 1e6, "bytes_in": totals["bytes_in"],
+                   "bytes_out": totals["bytes_out"], "allocated_blocks": totals["blocks"]}
+            if self.capture == "tracemalloc":
+                row["traced_kb"] = totals["traced"] // 1024
+            rows.append(row)
+        return rows
+
+    # text table of the stages, followed by the cProfile listing with that capture
+    def format(self, limit=20):
+        columns = ["stage", "calls", "ms", "bytes_in", "bytes_out", "allocated_blocks"]
+        if self.capture == "tracemalloc":
+            columns.append("traced_kb")
+        lines = [f"{columns[0]:<28}" + "".join(f"{column:>18}" for column in columns[1:])]
+        for row in self.rows():
+            lines.append(f"{row['stage']:<28}" + "".join(
+                f"{row[column]:>18.1f}" if column == "ms" else f"{row[column]:>18}" for column in columns[1:]))
+        text = "\n".join(lines)
+        if self.profiler is not None:
+            text += "\n\n" + self.call_profile(limit)
+        return text
+
+    # the functions with the most cumulative time, with the cProfile capture
+    def call_profile(self, limit=20):
+        if self.profiler is None:
+            return ""
+        with io.StringIO() as stream:
+            pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+            return stream.getvalue()
@@ -0,0 +1,295 @@
+from PIL import Image
+import numpy as np
+from compressors.bitpack import pack_bits
+from compressors import container, strips, profiling
+
+# range asymmetric numeral systems (rANS) with static per-tile frequency tables
+#
+# a tile channel is cut into `lanes` contiguous segments, each coded with its own 32-bit state;
+# the states advance in lockstep, so every encode and decode step is a handful of numpy
+# operations over all lanes instead of Python work per symbol
+#
+# payload   frequency table, final state of every lane (uint32), then the 16-bit
+#           renormalization words in the order the decoder reads them
+#
+# with order=1 every symbol is coded with the table of the symbol before it in its lane
+
+# frequencies are quantized to sum to 1 << PROB_BITS
+PROB_BITS = 12
+PROB_SCALE = 1 << PROB_BITS
+
+# states stay in [STATE_LOW, STATE_LOW << 16) and are renormalized 16 bits at a time
+STATE_LOW = 1 << 16
+WORD_BITS = 16
+
+# lanes per tile channel; more lanes mean fewer numpy steps, but every lane ends in a
+# 4-byte state of which about half is overhead (64 lanes are ~0.4% smaller and ~1.7x slower
+# than 128 on 256x256 tiles)
+DEFAULT_LANES = 128
+MAX_LANES = 255
+
+ORDERS = (0, 1)
+
+# format version of the payloads, part of the result cache key
+FORMAT_VERSION = 1
+
+# codec id in the tiled container
+CONTAINER_ID = 4
+
+# scale symbol counts to frequencies summing to PROB_SCALE, every symbol that occurs keeps at least 1
+def quantize_frequencies(counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    freqs = np.zeros(len(counts), dtype=np.int64)
+    present = counts > 0
+    if not present.any():
+        return freqs
+    freqs[present] = np.maximum(1, np.rint(counts[present] * PROB_SCALE / counts.sum())).astype(np.int64)
+    excess = int(freqs.sum()) - PROB_SCALE
+    if excess < 0:
+        freqs[np.argmax(counts)] -= excess
+    while excess > 0:
+        # take one from each of the most frequent symbols that can spare it, costs the least bits
+        order = np.argsort(-freqs, kind="stable")[:excess]
+        order = order[freqs[order] > 1]
+        freqs[order] -= 1
+        excess -= len(order)
+    return freqs
+
+# 256-bit presence mask, the width of the largest frequency - 1, then every present
+# frequency - 1 in that many bits
+def pack_frequencies(freqs):
+    present = freqs > 0
+    values = freqs[present] - 1
+    width = int(values.max()).bit_length() if values.size else 0
+    packed = b""
+    if width:
+        packed = pack_bits(values, np.full(values.size, width))[0].tobytes()
+    return np.packbits(present).tobytes() + bytes([width]) + packed
+
+# frequency table at the start of data, returns the frequencies and the bytes read
+def unpack_frequencies(data):
+    if len(data) < 33:
+        raise ValueError("Truncated rANS frequency table")
+    present = np.unpackbits(np.frombuffer(data[:32], dtype=np.uint8)).astype(bool)
+    width = data[32]
+    count = int(present.sum())
+    size = 33 + (count * width + 7) // 8
+    if width > PROB_BITS or len(data) < size:
+        raise ValueError("Invalid rANS frequency table")
+    freqs = np.zeros(256, dtype=np.int64)
+    if width:
+        bits = np.unpackbits(np.frombuffer(data[33:size], dtype=np.uint8))[:count * width].reshape(count, width)
+        freqs[present] = bits.astype(np.int64) @ (1 << np.arange(width - 1, -1, -1)) + 1
+    else:
+        freqs[present] = 1
+    if count and freqs.sum() != PROB_SCALE:
+        raise ValueError("Invalid rANS frequency table")
+    return freqs, size
+
+# symbols of a tile channel as a (lanes, steps) grid, lane k holding the k-th contiguous segment
+# (the last lane is padded with zeros); returns the grid, the symbol before every position in its
+# lane (0 at lane starts) and the number of lanes still active at every step
+def lane_grid(symbols, lanes):
+    count = len(symbols)
+    grid = np.zeros(lane_shape(count, lanes), dtype=np.uint8)
+    grid.reshape(-1)[:count] = symbols
+    previous = np.zeros_like(grid)
+    previous[:, 1:] = grid[:, :-1]
+    return grid, previous, active_lanes(count, lanes)
+
+# (lanes used, steps) for count symbols spread over at most lanes lanes
+def lane_shape(count, lanes):
+    steps = -(-count // lanes)
+    return (-(-count // steps) if count else 0), steps
+
+# lanes still active at every step, segments only get shorter towards the last lane
+def active_lanes(count, lanes):
+    used, steps = lane_shape(count, lanes)
+    lengths = np.minimum(steps, count - np.arange(used) * steps)
+    return (lengths[None, :] > np.arange(steps)[:, None]).sum(axis=1)
+
+# frequency and cumulative frequency tables, one row per context (one row with order 0)
+def context_tables(freqs):
+    cumulative = np.zeros_like(freqs)
+    cumulative[:, 1:] = np.cumsum(freqs, axis=1)[:, :-1]
+    return freqs, cumulative
+
+def encode_data(data, order=0, lanes=DEFAULT_LANES):
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    grid, previous, active = lane_grid(symbols, lanes)
+
+    if order == 0:
+        freqs = quantize_frequencies(np.bincount(symbols, minlength=256))[None, :]
+        table = pack_frequencies(freqs[0])
+        contexts = np.zeros_like(grid)
+    else:
+        # padding positions past the end of the last lane are not coded
+        pairs = previous.reshape(-1)[:len(symbols)].astype(np.int64) * 256 + symbols
+        counts = np.bincount(pairs, minlength=256 * 256).reshape(256, 256)
+        used = counts.sum(axis=1) > 0
+        freqs = np.zeros((256, 256), dtype=np.int64)
+        for context in np.flatnonzero(used).tolist():
+            freqs[context] = quantize_frequencies(counts[context])
+        table = np.packbits(used).tobytes() + b"".join(pack_frequencies(freqs[context])
+                                                       for context in np.flatnonzero(used).tolist())
+        contexts = previous
+
+    freqs, cumulative = context_tables(freqs)
+    f_grid = np.ascontiguousarray(freqs[contexts, grid].T.astype(np.uint64))
+    c_grid = np.ascontiguousarray(cumulative[contexts, grid].T.astype(np.uint64))
+    # a state at or above this bound would leave the range after coding the symbol
+    bounds = f_grid * np.uint64((STATE_LOW >> PROB_BITS) << WORD_BITS)
+
+    # rANS encodes backwards; the words of every step are kept together and the steps
+    # reversed at the end, so the decoder reads them front to back in lane order
+    states = np.full(grid.shape[0], STATE_LOW, dtype=np.uint64)
+    chunks = []
+    shift, mask = np.uint64(WORD_BITS), np.uint64((1 << WORD_BITS) - 1)
+    prob_bits = np.uint64(PROB_BITS)
+    for step in range(grid.shape[1] - 1, -1, -1):
+        a = active[step]
+        x = states[:a]
+        overflow = x >= bounds[step, :a]
+        if overflow.any():
+            chunks.append((x[overflow] & mask).astype("<u2"))
+            x[overflow] >>= shift
+        quotient, remainder = np.divmod(x, f_grid[step, :a])
+        states[:a] = (quotient << prob_bits) + remainder + c_grid[step, :a]
+
+    words = np.concatenate(chunks[::-1]).tobytes() if chunks else b""
+    return table + states.astype("<u4").tobytes() + words
+
+def decode_data(payload, count, order=0, lanes=DEFAULT_LANES):
+    if count == 0:
+        return b""
+    payload = memoryview(payload)
+    if order == 0:
+        freqs, offset = unpack_frequencies(payload)
+        freqs = freqs[None, :]
+        context_index = np.zeros(256, dtype=np.int64)
+    else:
+        if len(payload) < 32:
+            raise ValueError("Truncated rANS frequency table")
+        used = np.flatnonzero(np.unpackbits(np.frombuffer(payload[:32], dtype=np.uint8)))
+        offset = 32
+        rows = []
+        for _ in used:
+            row, size = unpack_frequencies(payload[offset:])
+            rows.append(row)
+            offset += size
+        freqs = np.array(rows, dtype=np.int64).reshape(-1, 256)
+        # contexts that never occur map to row 0, a valid stream never looks them up
+        context_index = np.zeros(256, dtype=np.int64)
+        context_index[used] = np.arange(len(used))
+
+    # decode tables over the probability range of every context: the symbol of each slot,
+    # its frequency and the slot's offset into the symbol's range
+    freqs, cumulative = context_tables(freqs)
+    rows = np.repeat(np.arange(len(freqs)), PROB_SCALE)
+    slot_symbol = np.repeat(np.tile(np.arange(256, dtype=np.uint8), len(freqs)), freqs.ravel())
+    slot_freq = freqs[rows, slot_symbol].astype(np.uint64)
+    slot_bias = (np.tile(np.arange(PROB_SCALE), len(freqs)) - cumulative[rows, slot_symbol]).astype(np.uint64)
+    context_offset = (context_index << PROB_BITS).astype(np.uint64)
+
+    used_lanes, steps = lane_shape(count, lanes)
+    active = active_lanes(count, lanes)
+
+    states_end = offset + 4 * used_lanes
+    if len(payload) < states_end or (len(payload) - states_end) % 2:
+        raise ValueError("Truncated rANS payload")
+    states = np.frombuffer(payload[offset:states_end], dtype="<u4").astype(np.uint64)
+    words = np.frombuffer(payload[states_end:], dtype="<u2").astype(np.uint64)
+
+    grid = np.zeros((steps, used_lanes), dtype=np.uint8)
+    previous = np.zeros(used_lanes, dtype=np.uint8)
+    shift, prob_bits = np.uint64(WORD_BITS), np.uint64(PROB_BITS)
+    slot_mask = np.uint64(PROB_SCALE - 1)
+    low = np.uint64(STATE_LOW)
+    position = 0
+    for step in range(steps):
+        a = active[step]
+        x = states[:a]
+        slot = x & slot_mask
+        if order:
+            slot += context_offset[previous[:a]]
+        symbol = slot_symbol[slot]
+        grid[step, :a] = symbol
+        x = slot_freq[slot] * (x >> prob_bits) + slot_bias[slot]
+        underflow = x < low
+        refill = int(np.count_nonzero(underflow))
+        if refill:
+            if position + refill > len(words):
+                raise ValueError("Truncated rANS payload")
+            x[underflow] = (x[underflow] << shift) | words[position:position + refill]
+            position += refill
+        states[:a] = x
+        if order:
+            previous[:a] = symbol
+
+    if position != len(words) or (states != low).any():
+        raise ValueError("Corrupt rANS payload")
+    return grid.T.reshape(-1)[:count].tobytes()
+
+# rANS-code one channel of one tile
+def encode_tile(data, order=0, lanes=DEFAULT_LANES):
+    with profiling.stage("rans.encode_data", len(data)) as stage:
+        encoded = encode_data(data, order, lanes)
+        stage.output(len(encoded))
+    return encoded
+
+# decode one channel tile of the tiled container, params hold the context order and lane count
+def decode_tile(payload, count, params):
+    with profiling.stage("rans.decode_data", len(payload)) as stage:
+        decoded = decode_data(payload, count, params[0], params[1])
+        stage.output(count)
+    return decoded
+
+def check_params(order, lanes):
+    if order not in ORDERS:
+        raise ValueError(f"Unknown rANS context order: {order}")
+    if not 1 <= lanes <= MAX_LANES:
+        raise ValueError(f"lanes must be between 1 and {MAX_LANES}")
+
+# encode an (h, w, 3) uint8 array with rANS per channel, in the tiled container
+# order 1 codes every byte with the statistics of the byte before it, which pays off on large
+# tiles only, since each tile stores up to 256 tables; lanes is the number of interleaved states,
+# color_transform and predictor select an optional reversible pre-transform;
+# with parallel=True the tiles are encoded in a process pool
+def encode(pixels, order=0, lanes=DEFAULT_LANES, color_transform="none", predictor="none", tile_size=None,
+           parallel=False, workers=None):
+    check_params(order, lanes)
+    return container.encode(pixels, CONTAINER_ID, encode_tile, (order, lanes), bytes([order, lanes]),
+                            color_transform, predictor, tile_size, parallel, workers)
+
+# encode an image arriving as (rows, w, 3) uint8 row strips into the seekable file f, params as for encode
+def encode_stream(image_strips, width, height, f, order=0, lanes=DEFAULT_LANES, color_transform="none",
+                  predictor="none", tile_size=None, parallel=False, workers=None):
+    check_params(order, lanes)
+    container.encode_stream(image_strips, width, height, f, CONTAINER_ID, encode_tile, (order, lanes),
+                            bytes([order, lanes]), color_transform, predictor, tile_size, parallel, workers)
+
+# compress an RGB image with rANS per channel, params as for encode
+def compress(input_image_path, output_path, **params):
+    with profiling.stage("io.read_image"):
+        image = Image.open(input_image_path).convert("RGB")
+    data = encode(np.asarray(image), **params)
+    with profiling.stage("io.write_file", len(data)):
+        with open(output_path, "wb") as f:
+            f.write(data)
+
+# compress an image read in row strips, memory use does not grow with the image height
+def compress_stream(input_image_path, output_path, strip_rows=strips.STRIP_ROWS, **params):
+    width, height, image_strips = strips.read_strips(input_image_path, strip_rows)
+    with open(output_path, "wb") as f:
+        encode_stream(image_strips, width, height, f, **params)
+
+# decode rANS-coded bytes back into an (h, w, 3) uint8 array
+# with parallel=True the tiles are decoded in a process pool
+def decode(data, parallel=False, workers=None):
+    return container.decode(data, parallel, workers, CONTAINER_ID)
+
+# decompress a rANS-coded RGB image
+def decompress(input_path, output_image_path, **options):
+    pixels = decode(container.map_file(input_path), **options)
+    with profiling.stage("io.write_image", pixels.nbytes):
+        Image.fromarray(pixels, "RGB").save(output_image_path)
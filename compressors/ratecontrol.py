@@ -0,0 +1,117 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from compressors import jpeg, jpeg2000
+from metrics import as_pixels, luma, calculate_metrics
+
+# parameter searched for each lossy codec and its candidate values, from lowest to highest quality
+# (JPEG 2000 quality goes down as its compression ratio goes up)
+KNOBS = {
+    "JPEG": ("quality", list(range(1, 101))),
+    "JPEG 2000": ("compression_ratio", list(range(200, 0, -1))),
+}
+
+TARGETS = ["max_bytes", "min_psnr", "min_ssim"]
+
+# candidates tried per bisection round, one per worker thread
+DEFAULT_WORKERS = 4
+
+# encodes, decodes and measures candidate parameter values of one codec on one image
+# every value is encoded at most once, and the pixel conversion and the reference luma
+# used by SSIM are computed once for the whole search
+class Candidates:
+    def __init__(self, name, pixels, metric=None):
+        if name not in KNOBS:
+            raise ValueError(f"No rate control for codec: {name}")
+        self.name = name
+        self.pixels = np.ascontiguousarray(as_pixels(pixels))
+        self.metric = metric
+        self.reference_luma = luma(self.pixels) if metric == "ssim" else None
+        self.results = {}
+        self.lock = threading.Lock()
+        # PIL keeps encoder options on the image while saving, so each thread converts its own copy once
+        self.local = threading.local()
+
+    def encode(self, value):
+        if self.name == "JPEG":
+            image = getattr(self.local, "image", None)
+            if image is None:
+                image = self.local.image = Image.fromarray(self.pixels, "RGB")
+            return jpeg.encode_image(image, value)
+        return jpeg2000.encode(self.pixels, value)
+
+    def decode(self, data):
+        return jpeg.decode(data) if self.name == "JPEG" else jpeg2000.decode(data)
+
+    # (encoded bytes, metric value or None) of a parameter value, (None, None) if the encoder
+    # fails on it, so one bad candidate only drops out of the search instead of ending it
+    def measure(self, value):
+        with self.lock:
+            if value in self.results:
+                return self.results[value]
+        try:
+            data = self.encode(value)
+        except (OSError, RuntimeError):
+            data = None
+        score = None
+        if self.metric is not None and data is not None:
+            score = calculate_metrics(self.pixels, self.decode(data), [self.metric],
+                                      original_luma=self.reference_luma)[self.metric]
+        with self.lock:
+            self.results[value] = data, score
+        return data, score
+
+# smallest index in [0, count) where the monotonic predicate holds, or count if it never does
+# each round checks up to probes evenly spaced indexes of the remaining range in parallel
+def first_passing(count, passes, executor, probes):
+    low, high = -1, count
+    while high - low > 1:
+        step = (high - low) / (probes + 1)
+        indexes = sorted({low + max(1, round(step * i)) for i in range(1, probes + 1)} - {high})
+        indexes = [i for i in indexes if low < i < high]
+        results = list(executor.map(passes, indexes))
+        for index, result in zip(indexes, results):
+            if result:
+                high = index
+                break
+            low = index
+    return high
+
+# find the best parameter of a lossy codec that meets exactly one target:
+#   max_bytes - highest quality whose encoding fits in that many bytes
+#   min_psnr / min_ssim - smallest encoding that reaches that quality
+# candidates are encoded in memory and measured on a thread pool (Pillow and glymur release the GIL),
+# returns (parameter value, encoded bytes); raises ValueError if no candidate meets the target
+def search(name, pixels, max_bytes=None, min_psnr=None, min_ssim=None, workers=DEFAULT_WORKERS):
+    targets = {"max_bytes": max_bytes, "min_psnr": min_psnr, "min_ssim": min_ssim}
+    given = [target for target, value in targets.items() if value is not None]
+    if len(given) != 1:
+        raise ValueError(f"Expected exactly one of {', '.join(TARGETS)}")
+    target = given[0]
+    limit = targets[target]
+    candidates = Candidates(name, pixels, None if target == "max_bytes" else target[len("min_"):])
+    _, values = KNOBS[name]
+
+    # a value the encoder failed on counts as missing the target
+    def too_large(i):
+        data, _ = candidates.measure(values[i])
+        return data is None or len(data) > limit
+
+    def good_enough(i):
+        _, score = candidates.measure(values[i])
+        return score is not None and score >= limit
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if target == "max_bytes":
+            # sizes grow with quality: the answer is just below the first value that is too large
+            index = first_passing(len(values), too_large, executor, workers) - 1
+        else:
+            index = first_passing(len(values), good_enough, executor, workers)
+            if index == len(values):
+                index = -1
+    data = candidates.measure(values[index])[0] if index >= 0 else None
+    if data is None:
+        raise ValueError(f"No {name} {KNOBS[name][0]} meets {target}={limit}")
+    return values[index], data
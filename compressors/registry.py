@@ -0,0 +1,64 @@
+import numpy as np
+from compressors import huffman, lzw, deflate, rans, jpeg, jpeg2000
+
+# a compression algorithm bound to a set of encoder parameters
+# encode/decode work on (h, w, 3) uint8 arrays and bytes, compress/decompress on files
+class Codec:
+    def __init__(self, name, module, lossless, **params):
+        self.name = name
+        self.module = module
+        self.lossless = lossless
+        self.params = params
+
+    # copy of this codec with some parameters replaced
+    def with_params(self, **params):
+        return Codec(self.name, self.module, self.lossless, **{**self.params, **params})
+
+    # changes whenever the encoder output may change: the container format version of
+    # our own codecs, the library version of the ones backed by Pillow or glymur
+    @property
+    def version(self):
+        return str(getattr(self.module, "FORMAT_VERSION", None) or self.module.LIBRARY_VERSION)
+
+    def encode(self, pixels):
+        return self.module.encode(as_rgb(pixels), **self.params)
+
+    def decode(self, data, **options):
+        return self.module.decode(data, **options)
+
+    def compress(self, input_image_path, output_path):
+        self.module.compress(input_image_path, output_path, **self.params)
+
+    def decompress(self, input_path, output_image_path, **options):
+        self.module.decompress(input_path, output_image_path, **options)
+
+    def __repr__(self):
+        params = ", ".join(f"{key}={value!r}" for key, value in self.params.items())
+        return f"Codec({self.name!r}{', ' if params else ''}{params})"
+
+# check that pixels are an (h, w, 3) uint8 array the codecs can encode
+def as_rgb(pixels):
+    pixels = np.ascontiguousarray(pixels)
+    if pixels.dtype != np.uint8 or pixels.ndim != 3 or pixels.shape[2] != 3:
+        raise ValueError(f"Expected an (h, w, 3) uint8 array, got {pixels.dtype} {pixels.shape}")
+    return pixels
+
+# codecs by the name shown in the GUI, with their default parameters
+CODECS = {}
+
+def register(codec):
+    CODECS[codec.name] = codec
+    return codec
+
+# codec by name, with parameters overriding its defaults
+def get_codec(name, **params):
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}")
+    return CODECS[name].with_params(**params)
+
+register(Codec("Huffman", huffman, lossless=True))
+register(Codec("LZW", lzw, lossless=True))
+register(Codec("DEFLATE", deflate, lossless=True))
+register(Codec("rANS", rans, lossless=True))
+register(Codec("JPEG", jpeg, lossless=False, quality=75))
+register(Codec("JPEG 2000", jpeg2000, lossless=False, compression_ratio=10))
@@ -0,0 +1,72 @@
+import numpy as np
+from PIL import Image
+
+# rows read from a source image at a time
+STRIP_ROWS = 256
+
+# uncompressed layouts PIL reports that can be memory-mapped directly:
+# raw mode -> (bytes per pixel, positions of R, G and B in a pixel)
+RAW_LAYOUTS = {
+    "RGB": (3, [0, 1, 2]),
+    "BGR": (3, [2, 1, 0]),
+    "RGBX": (4, [0, 1, 2]),
+    "RGBA": (4, [0, 1, 2]),
+    "BGRX": (4, [2, 1, 0]),
+    "BGRA": (4, [2, 1, 0]),
+    "L": (1, [0, 0, 0]),
+}
+
+# open an image for reading in row strips
+# returns width, height and an iterator over (rows, w, 3) uint8 strips, top to bottom;
+# .npy files and uncompressed images (BMP, TIFF, PPM, ...) are memory-mapped so only the
+# current strip is read, other formats have to be decoded as a whole by PIL first
+def read_strips(path, rows=STRIP_ROWS):
+    if path.lower().endswith(".npy"):
+        pixels = np.load(path, mmap_mode="r")
+        if pixels.dtype != np.uint8 or pixels.ndim != 3 or pixels.shape[2] != 3:
+            raise ValueError(f"Expected an (h, w, 3) uint8 array, got {pixels.dtype} {pixels.shape}")
+        return pixels.shape[1], pixels.shape[0], array_strips(pixels, rows)
+
+    with Image.open(path) as image:
+        width, height = image.size
+        raw = raw_layout(image)
+        if raw is None:
+            pixels = np.asarray(image.convert("RGB"))
+            return width, height, array_strips(pixels, rows)
+
+    offset, stride, orientation, (bytes_per_pixel, channels) = raw
+    mapped = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, stride))
+    pixels = mapped[:, :width * bytes_per_pixel].reshape(height, width, bytes_per_pixel)
+    if orientation < 0:
+        # bottom-up rows, as in BMP files
+        pixels = pixels[::-1]
+    return width, height, array_strips(pixels, rows, channels)
+
+# (offset, row stride, orientation, layout) of an image stored as one uncompressed block, else None
+def raw_layout(image):
+    if len(image.tile) != 1 or image.tile[0][0] != "raw" or image.tile[0][1] != (0, 0) + image.size:
+        return None
+    _, _, offset, args = image.tile[0]
+    raw_mode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+    if raw_mode not in RAW_LAYOUTS or image.mode not in ("RGB", "RGBA", "RGBX", "L"):
+        return None
+    layout = RAW_LAYOUTS[raw_mode]
+    return offset, stride or image.size[0] * layout[0], orientation or 1, layout
+
+# contiguous strips of an array, channels picks the R, G and B planes of each strip
+def array_strips(pixels, rows, channels=None):
+    for start in range(0, pixels.shape[0], rows):
+        strip = pixels[start:start + rows]
+        yield np.ascontiguousarray(strip if channels is None else strip[:, :, channels])
+
+# write (rows, w, 3) uint8 strips as a binary PPM image, one strip at a time
+# with channels=1 the strips hold one plane and a PGM image is written
+def write_ppm(path, width, height, strips, channels=3):
+    written = 0
+    with open(path, "wb") as f:
+        f.write(f"{'P6' if channels == 3 else 'P5'}\n{width} {height}\n255\n".encode())
+        for strip in strips:
+            f.write(np.ascontiguousarray(strip).data)
+            written += strip.shape[0]
+    if written != height:
+        raise ValueError(f"Got {written} rows for an image of height {height}")
@@ -0,0 +1,119 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+# images above this many pixels per channel are cut into horizontal tiles
+TILE_PIXELS = 1 << 18
+
+# rows per tile so that every tile holds about TILE_PIXELS pixels
+def default_tile_rows(width, height):
+    return max(1, min(height, TILE_PIXELS // max(width, 1)))
+
+# (start, end) row ranges of the horizontal tiles
+def tile_ranges(height, tile_rows):
+    return [(start, min(start + tile_rows, height)) for start in range(0, height, tile_rows)] or [(0, 0)]
+
+# (rows, columns) slices of a tile, given as (channel, start_row, end_row) for full-width tiles
+# or (channel, start_row, end_row, start_column, end_column)
+def tile_slices(tile):
+    _, start, end, *columns = tile
+    return slice(start, end), slice(*columns) if columns else slice(None)
+
+# one tile of planar (3, h, w) pixels as a flat memoryview, copied only if it is not contiguous
+def tile_data(planes, tile):
+    rows, columns = tile_slices(tile)
+    return memoryview(np.ascontiguousarray(planes[tile[0], rows, columns]).reshape(-1))
+
+# write decoded tile bytes straight into their channel of interleaved (h, w, 3) pixels
+def store_tile(pixels, tile, decoded):
+    rows, columns = tile_slices(tile)
+    target = pixels[rows, columns, tile[0]]
+    target[...] = np.frombuffer(decoded, dtype=np.uint8).reshape(target.shape)
+
+# copy an array into a new shared memory block
+def share(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block
+
+def release(block):
+    block.close()
+    block.unlink()
+
+# worker side of encode_tiles: read one tile of the shared planes and encode it
+def encode_shared_tile(function, name, shape, tile, args):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        planes = np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+        with tile_data(planes, tile) as data:
+            del planes
+            return bytes(function(data, *args))
+    finally:
+        block.close()
+
+# worker side of decode_tiles: decode one payload straight into the shared output pixels
+def decode_shared_tile(function, input_name, offset, length, output_name, shape, tile, args):
+    source = shared_memory.SharedMemory(name=input_name)
+    target = shared_memory.SharedMemory(name=output_name)
+    try:
+        with source.buf[offset:offset + length] as payload:
+            decoded = function(payload, *args)
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=target.buf)
+        store_tile(pixels, tile, decoded)
+        del pixels
+    finally:
+        source.close()
+        target.close()
+
+# encode every tile (see tile_slices) of planar (3, h, w) pixels
+# function(data, *args) gets the tile as a flat memoryview and returns the encoded bytes;
+# with parallel=True the planes sit in shared memory and tiles run in a process pool,
+# parallel="threads" runs them on a thread pool instead, for functions that release the GIL
+def encode_tiles(function, planes, tiles, args, parallel=False, workers=None):
+    if not parallel:
+        return [function(tile_data(planes, tile), *a) for tile, a in zip(tiles, args)]
+    if parallel == "threads":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda tile, a: function(tile_data(planes, tile), *a), tiles, args))
+
+    block = share(planes)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_shared_tile, function, block.name, planes.shape, tile, a)
+                       for tile, a in zip(tiles, args)]
+            return [future.result() for future in futures]
+    finally:
+        release(block)
+
+# decode payloads back into one interleaved (h, w, 3) array, one payload per tile
+# every tile is written into its slice of the output as soon as it is decoded;
+# function(payload, *args) returns the decoded tile bytes; in parallel mode the payloads
+# and the output are shared with a process pool instead of being pickled,
+# parallel="threads" decodes on a thread pool
+def decode_tiles(function, shape, tiles, payloads, args, parallel=False, workers=None):
+    if not parallel or parallel == "threads":
+        pixels = np.empty(shape, dtype=np.uint8)
+        if not parallel:
+            for tile, payload, a in zip(tiles, payloads, args):
+                store_tile(pixels, tile, function(payload, *a))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda tile, payload, a: store_tile(pixels, tile, function(payload, *a)),
+                                  tiles, payloads, args))
+        return pixels
+
+    lengths = [len(payload) for payload in payloads]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).tolist()
+    source = share(np.frombuffer(b"".join(payloads), dtype=np.uint8))
+    target = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(decode_shared_tile, function, source.name, offset, length,
+                                       target.name, shape, tile, a)
+                       for tile, offset, length, a in zip(tiles, offsets, lengths, args)]
+            for future in futures:
+                future.result()
+        return np.ndarray(shape, dtype=np.uint8, buffer=target.buf).copy()
+    finally:
+        release(source)
+        release(target)
@@ -0,0 +1,106 @@
+import numpy as np
+
+# reversible pre-transforms for the lossless codecs
+# every step works modulo 256, so transformed planes stay uint8 and invert exactly
+
+COLOR_TRANSFORMS = ["none", "ycocg-r"]
+PREDICTORS = ["none", "sub", "up", "average", "paeth", "med"]
+
+# reinterpret values modulo 256 as signed bytes
+def signed(values):
+    return values.astype(np.uint8).view(np.int8).astype(np.int16)
+
+# modular YCoCg-R lifting: R, G, B -> Y, Co, Cg
+def ycocg_forward(pixels):
+    r, g, b = (pixels[:, :, i].astype(np.int16) for i in range(3))
+    co = (r - b) & 0xFF
+    t = (b + (signed(co) >> 1)) & 0xFF
+    cg = (g - t) & 0xFF
+    y = (t + (signed(cg) >> 1)) & 0xFF
+    return np.stack([y, co, cg], axis=2).astype(np.uint8)
+
+# undo the lifting steps in reverse order
+def ycocg_inverse(pixels):
+    y, co, cg = (pixels[:, :, i].astype(np.int16) for i in range(3))
+    t = (y - (signed(cg) >> 1)) & 0xFF
+    g = (cg + t) & 0xFF
+    b = (t - (signed(co) >> 1)) & 0xFF
+    r = (b + co) & 0xFF
+    return np.stack([r, g, b], axis=2).astype(np.uint8)
+
+# predict a pixel from its left (a), upper (b) and upper-left (c) neighbours
+def predict(a, b, c, predictor):
+    if predictor == "sub":
+        return a
+    if predictor == "up":
+        return b
+    if predictor == "average":
+        return (a + b) >> 1
+    if predictor == "paeth":
+        p = a + b - c
+        pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+        return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    if predictor == "med":
+        # LOCO-I median edge detector
+        low, high = np.minimum(a, b), np.maximum(a, b)
+        return np.where(c >= high, low, np.where(c <= low, high, a + b - c))
+    raise ValueError(f"Unknown predictor: {predictor}")
+
+# replace every pixel by its prediction residual, neighbours outside the image count as 0
+def predict_forward(pixels, predictor):
+    padded = np.zeros((pixels.shape[0] + 1, pixels.shape[1] + 1, pixels.shape[2]), dtype=np.int16)
+    padded[1:, 1:] = pixels
+    prediction = predict(padded[1:, :-1], padded[:-1, 1:], padded[:-1, :-1], predictor)
+    return ((padded[1:, 1:] - prediction) & 0xFF).astype(np.uint8)
+
+# rebuild pixels from residuals
+# sub and up are running sums, the others are solved one anti-diagonal at a time,
+# since every neighbour of a pixel lies on an earlier diagonal
+def predict_inverse(residuals, predictor):
+    if predictor == "sub":
+        return np.cumsum(residuals, axis=1, dtype=np.uint8)
+    if predictor == "up":
+        return np.cumsum(residuals, axis=0, dtype=np.uint8)
+
+    height, width = residuals.shape[:2]
+    padded = np.zeros((height + 1, width + 1, residuals.shape[2]), dtype=np.int16)
+    for d in range(height + width - 1):
+        ys = np.arange(max(0, d - width + 1), min(height, d + 1))
+        xs = d - ys
+        prediction = predict(padded[ys + 1, xs], padded[ys, xs + 1], padded[ys, xs], predictor)
+        padded[ys + 1, xs + 1] = (residuals[ys, xs] + prediction) & 0xFF
+    return padded[1:, 1:].astype(np.uint8)
+
+# apply the color transform, then the predictor, to an (h, w, 3) uint8 array
+def forward(pixels, color_transform="none", predictor="none"):
+    validate(color_transform, predictor)
+    if color_transform == "ycocg-r":
+        pixels = ycocg_forward(pixels)
+    if predictor != "none":
+        pixels = predict_forward(pixels, predictor)
+    return pixels
+
+# exact inverse of forward
+def inverse(pixels, color_transform="none", predictor="none"):
+    validate(color_transform, predictor)
+    if predictor != "none":
+        pixels = predict_inverse(pixels, predictor)
+    if color_transform == "ycocg-r":
+        pixels = ycocg_inverse(pixels)
+    return pixels
+
+def validate(color_transform, predictor):
+    if color_transform not in COLOR_TRANSFORMS:
+        raise ValueError(f"Unknown color transform: {color_transform}")
+    if predictor not in PREDICTORS:
+        raise ValueError(f"Unknown predictor: {predictor}")
+
+# two header bytes recording the transforms applied before entropy coding
+def pack_flags(color_transform, predictor):
+    validate(color_transform, predictor)
+    return bytes([COLOR_TRANSFORMS.index(color_transform), PREDICTORS.index(predictor)])
+
+def unpack_flags(data):
+    if data[0] >= len(COLOR_TRANSFORMS) or data[1] >= len(PREDICTORS):
+        raise ValueError("Unknown transform flags in compressed data")
+    return COLOR_TRANSFORMS[data[0]], PREDICTORS[data[1]]
@@ -1,24 +1,206 @@
-from PIL import Image
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# converts every image under a directory tree into a set of formats, for benchmarking
+# decode cost per input format; each source is decoded once and encoded into all of its
+# stale targets by one worker process, outputs that are up to date are skipped
+
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif', '.pgm', '.ppm', '.gif', '.webp')
+FORMATS = ["jpeg", "png", "webp", "gif", "tiff"]
+
+# record of the source and options behind every output, kept in the output directory
+STATE_FILE = ".conversions.json"
 
-input_folder = "test_images"
-input_filename = "baboon.bmp"
-input_path = os.path.join(input_folder, input_filename)
+# how a source is judged unchanged: size and modification time, or a content hash
+# (slower, but survives copies and checkouts that touch every file)
+CHECKS = ["mtime", "hash"]
 
-img = Image.open(input_path)
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-formats = ["jpeg", "png", "webp", "gif", "tiff"]
+# every source image under a directory, as paths relative to it
+def find_sources(directory, exclude=None):
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if exclude is None or os.path.abspath(os.path.join(root, d)) != exclude)
+        for name in sorted(files):
+            if name.lower().endswith(SOURCE_EXTENSIONS):
+                sources.append(os.path.relpath(os.path.join(root, name), directory))
+    return sources
 
-for fmt in formats:
-    base_name = os.path.splitext(input_filename)[0]
-    output_filename = f"{base_name}.{fmt}"
-    output_path = os.path.join(input_folder, output_filename)
+def output_path(output_dir, source, fmt):
+    return os.path.join(output_dir, os.path.splitext(source)[0] + f".{fmt}")
 
+# the image in a mode the format can store
+def prepare(image, fmt):
     if fmt == "gif":
-        img_converted = img.convert("P")
-    else:
-        img_converted = img
+        return image if image.mode in ("P", "L") else image.convert("P")
+    if fmt == "jpeg" and image.mode not in ("RGB", "L", "CMYK"):
+        return image.convert("RGB")
+    if image.mode not in ("1", "L", "P", "RGB", "RGBA"):
+        return image.convert("RGB")
+    return image
+
+# decode one source and write it in every requested format, runs in a worker process
+# returns (decode ms, {format: (encode ms, output bytes)})
+def convert(source_path, targets, options):
+    start = time.perf_counter()
+    with Image.open(source_path) as image:
+        image.load()
+    decode_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    for fmt, path in targets:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        start = time.perf_counter()
+        # written under a temporary name, so an interrupted run never leaves a truncated output
+        temporary = f"{path}.tmp"
+        prepare(image, fmt).save(temporary, format=fmt.upper(), **options.get(fmt, {}))
+        os.replace(temporary, path)
+        results[fmt] = ((time.perf_counter() - start) * 1000, os.path.getsize(path))
+    return decode_ms, results
+
+def load_state(output_dir):
+    try:
+        with open(os.path.join(output_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_state(output_dir, state):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+
+# what an output was made from: source size, mtime and (with the hash check) digest, plus encoder options
+def source_record(source_path, fmt, options, check, previous=None):
+    stat = os.stat(source_path)
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "options": options.get(fmt, {})}
+    if check == "hash":
+        # reuse the digest while size and mtime still match what it was computed from
+        unchanged = previous and previous.get("size") == record["size"] and previous.get("mtime_ns") == record["mtime_ns"]
+        record["digest"] = previous["digest"] if unchanged and "digest" in previous else file_digest(source_path)
+    return record
+
+def up_to_date(record, previous, path, check):
+    if previous is None or not os.path.exists(path) or previous.get("output_mtime_ns") != os.stat(path).st_mtime_ns:
+        return False
+    if record["options"] != previous.get("options"):
+        return False
+    # outputs written under the mtime check have no digest yet, they are judged by it once more
+    if check == "hash" and "digest" in previous:
+        return record["digest"] == previous["digest"]
+    return record["size"] == previous.get("size") and record["mtime_ns"] == previous.get("mtime_ns")
+
+# "jpeg:quality=90" -> ("jpeg", "quality", 90), values are parsed as JSON when they can be
+def parse_option(text):
+    fmt, _, assignment = text.partition(":")
+    key, _, value = assignment.partition("=")
+    if not fmt or not key or not value:
+        raise argparse.ArgumentTypeError(f"Expected FORMAT:KEY=VALUE, got {text}")
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return fmt.lower(), key, value
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory tree of images into several formats.")
+    parser.add_argument("--input", default="test_images", help="directory tree with the source images")
+    parser.add_argument("--output", default="converted_images", help="directory the converted tree is written to")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, metavar="FORMAT",
+                        help=f"Pillow format names to write (default: {' '.join(FORMATS)})")
+    parser.add_argument("--option", action="append", type=parse_option, default=[], metavar="FORMAT:KEY=VALUE",
+                        help="encoder option, e.g. jpeg:quality=90 or webp:lossless=true (repeatable)")
+    parser.add_argument("--check", choices=CHECKS, default="mtime", help="how to detect changed sources")
+    parser.add_argument("--force", action="store_true", help="convert everything, even outputs that are up to date")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    formats = [fmt.lower() for fmt in args.formats]
+    options = {}
+    for fmt, key, value in args.option:
+        options.setdefault(fmt, {})[key] = value
+
+    sources = find_sources(args.input, exclude=os.path.abspath(args.output))
+    if not sources:
+        sys.exit(f"No images found in {args.input}")
+    state = load_state(args.output)
+
+    # the stale targets of every source, checked before any work is handed out
+    jobs = []
+    records = {}
+    skipped = 0
+    for source in sources:
+        source_path = os.path.join(args.input, source)
+        targets = []
+        for fmt in formats:
+            path = output_path(args.output, source, fmt)
+            key = os.path.relpath(path, args.output)
+            previous = state.get(key)
+            record = source_record(source_path, fmt, options, args.check, previous)
+            if not args.force and up_to_date(record, previous, path, args.check):
+                # a touched but unchanged source is recorded with its new mtime, so it is not hashed again
+                previous.update(size=record["size"], mtime_ns=record["mtime_ns"], **(
+                    {"digest": record["digest"]} if "digest" in record else {}))
+                skipped += 1
+                continue
+            records[key] = record
+            targets.append((fmt, path))
+        if targets:
+            jobs.append((source, source_path, targets))
+
+    start = time.perf_counter()
+    decode_ms = 0.0
+    encode_ms = {fmt: [] for fmt in formats}
+    output_bytes = {fmt: 0 for fmt in formats}
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [(source, targets, executor.submit(convert, source_path, targets, options))
+                   for source, source_path, targets in jobs]
+        for source, targets, future in futures:
+            try:
+                decoded_ms, results = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"Failed {source}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            decode_ms += decoded_ms
+            for fmt, path in targets:
+                elapsed, size = results[fmt]
+                encode_ms[fmt].append(elapsed)
+                output_bytes[fmt] += size
+                key = os.path.relpath(path, args.output)
+                state[key] = {**records[key], "source": source, "output_mtime_ns": os.stat(path).st_mtime_ns}
+                print(f"Saved {path}", file=sys.stderr)
+    wall_ms = (time.perf_counter() - start) * 1000
+    save_state(args.output, state)
 
-    img_converted.save(output_path, format=fmt.upper())
+    converted = sum(len(times) for times in encode_ms.values())
+    print(f"{len(sources)} sources, {converted} outputs written, {skipped} up to date, {failures} failed")
+    print(f"decoded {len(jobs)} sources once each in {decode_ms:.0f} ms of worker time")
+    print(f"{'format':<8}{'files':>7}{'encode ms':>12}{'mean ms':>10}{'MB':>10}")
+    for fmt in formats:
+        times = encode_ms[fmt]
+        if times:
+            print(f"{fmt:<8}{len(times):>7}{sum(times):>12.0f}{sum(times) / len(times):>10.1f}"
+                  f"{output_bytes[fmt] / 1e6:>10.2f}")
+    print(f"wall time {wall_ms:.0f} ms")
 
-    print(f"Saved {output_path}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import time
+import queue
+import threading
+import contextlib
+import numpy as np
+from PIL import Image
+
+from advisor import AUTO, recommend
+from compressors import profiling
+from metrics import compression_rate, calculate_metrics
+from result_cache import result_key, pixels_digest
+
+# stages of a compression job, reported in this order
+STAGES = ["Loading image", "Compressing", "Decompressing", "Computing metrics", "Saving results"]
+
+class Cancelled(Exception):
+    pass
+
+# one compress + decompress + metrics run of a codec on an image file
+# run() happens on a worker thread; cancellation is checked between stages,
+# since a codec call itself cannot be interrupted
+# codec may be AUTO, the advisor then picks a lossless codec once the image is loaded
+# with profile=True the run records per-stage timings (compressors/profiling.py), capture picks an
+# extra cProfile or tracemalloc capture; profiled runs always measure instead of reading the cache
+class Job:
+    def __init__(self, image_path, codec, cache=None, output_dir="results", profile=False, capture=None):
+        self.image_path = image_path
+        self.codec = codec
+        self.cache = cache
+        self.output_dir = output_dir
+        self.profile = profile
+        self.capture = capture
+        self.cancelled = threading.Event()
+
+    def __str__(self):
+        if self.codec == AUTO:
+            return f"{AUTO} on {os.path.basename(self.image_path)}"
+        params = ", ".join(f"{key}={value}" for key, value in self.codec.params.items())
+        name = f"{self.codec.name} ({params})" if params else self.codec.name
+        return f"{name} on {os.path.basename(self.image_path)}"
+
+    def cancel(self):
+        self.cancelled.set()
+
+    # progress(stage) is called with the index into STAGES before every stage
+    def stage(self, progress, index):
+        if self.cancelled.is_set():
+            raise Cancelled()
+        progress(index)
+
+    # returns a dict with the pixel arrays, metrics and timings for the results window,
+    # profiled runs add "stages" (rows of profiling.Profile) and "call_profile" (cProfile text or "")
+    def run(self, progress):
+        profile = profiling.Profile(self.capture) if self.profile else None
+        with profile or contextlib.nullcontext():
+            result = self.execute(progress)
+        if profile is not None:
+            result["stages"] = profile.rows()
+            result["call_profile"] = profile.call_profile()
+        return result
+
+    def execute(self, progress):
+        self.stage(progress, 0)
+        with profiling.stage("job.load_image"):
+            original_img = Image.open(self.image_path).convert("RGB")
+            pixels = np.asarray(original_img)
+        if self.codec == AUTO:
+            self.codec = recommend(pixels)
+
+        tag = self.codec.name.lower().replace(" ", "")
+        filename = os.path.splitext(os.path.basename(self.image_path))[0]
+        compressed_path = os.path.join(self.output_dir, f"{filename}_{tag}.bin")
+        reconstructed_path = os.path.join(self.output_dir, f"{filename}_{tag}_reconstructed.png")
+        key = result_key(pixels_digest(pixels), self.codec)
+        record = self.cache.get(key, image=True) if self.cache is not None and not self.profile else None
+        cached = record is not None
+
+        if not cached:
+            # time only the codec itself, file writes happen afterwards
+            self.stage(progress, 1)
+            compress_start = time.perf_counter()
+            compressed = self.codec.encode(pixels)
+            compress_end = time.perf_counter()
+
+            self.stage(progress, 2)
+            decompress_start = time.perf_counter()
+            reconstructed = self.codec.decode(compressed)
+            decompress_end = time.perf_counter()
+
+            self.stage(progress, 3)
+            with profiling.stage("job.metrics"):
+                quality = calculate_metrics(pixels, reconstructed, ["psnr", "ssim"])
+            record = {
+                "compressed_bytes": len(compressed),
+                "encode_ms": (compress_end - compress_start) * 1000,
+                "decode_ms": (decompress_end - decompress_start) * 1000,
+                "psnr": quality["psnr"],
+                "ssim": quality["ssim"],
+            }
+        else:
+            reconstructed = record.pop("reconstructed")
+
+        self.stage(progress, 4)
+        with profiling.stage("job.save"):
+            os.makedirs(self.output_dir, exist_ok=True)
+            if not cached:
+                if self.cache is not None:
+                    self.cache.put(key, record, reconstructed)
+                with open(compressed_path, "wb") as f:
+                    f.write(compressed)
+            if not cached or not os.path.exists(reconstructed_path):
+                Image.fromarray(reconstructed, "RGB").save(reconstructed_path)
+
+        return {
+            "original": pixels,
+            "reconstructed": reconstructed,
+            "comp_rate": compression_rate(os.path.getsize(self.image_path), record["compressed_bytes"]),
+            "psnr": record["psnr"],
+            "ssim": record["ssim"],
+            "compress_time": record["encode_ms"],
+            "decompress_time": record["decode_ms"],
+            "cached": cached,
+        }
+
+# runs jobs one after another on a background thread
+# the GUI submits jobs and polls for (kind, job, value) events from its own thread:
+#   ("progress", job, stage index), ("done", job, result), ("error", job, exception), ("cancelled", job, None)
+class JobQueue:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def submit(self, job):
+        with self.lock:
+            self.pending.append(job)
+        self.jobs.put(job)
+
+    # cancel the running job and everything queued behind it
+    def cancel_all(self):
+        with self.lock:
+            for job in self.pending:
+                job.cancel()
+
+    # submitted jobs that have not finished yet, the running one first
+    def active(self):
+        with self.lock:
+            return list(self.pending)
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                result = job.run(lambda index: self.events.put(("progress", job, index)))
+                event = ("done", job, result)
+            except Cancelled:
+                event = ("cancelled", job, None)
+            except Exception as e:
+                event = ("error", job, e)
+            with self.lock:
+                self.pending.remove(job)
+            self.events.put(event)
+
+    # events posted since the last call, without blocking
+    def poll(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
@@ -1,6 +1,4 @@
 import os
-import time
-import glob
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk
@@ -8,30 +6,47 @@ from skimage.metrics import structural_similarity as compare_ssim
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 
-from compressors import huffman, lzw, deflate, jpeg, jpeg2000
-from metrics import calculate_compression_rate, calculate_psnr, calculate_ssim
+from compressors.registry import CODECS, get_codec
+from advisor import AUTO
+from result_cache import ResultCache
+from jobs import Job, JobQueue, STAGES
+from thumbnails import ThumbnailCache, DirectoryIndex, thumbnail_from_array
 
 selected_image_path = None
 selected_test_image = None
-
-def show_results_window(original_img, reconstructed_img, comp_rate, psnr, ssim, compress_time, decompress_time):
+result_cache = ResultCache()
+job_queue = JobQueue()
+thumbnail_cache = ThumbnailCache()
+test_images_index = DirectoryIndex("test_images", ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.pgm', '.gif', '.webp', '.jp2', '.j2k'))
+
+# how often the GUI checks the worker for progress
+POLL_MS = 100
+
+# profiling choices: label -> (record stage timings, extra capture mode)
+PROFILE_MODES = {
+    "Off": (False, None),
+    "Stage timings": (True, None),
+    "Stages + cProfile": (True, "cprofile"),
+    "Stages + tracemalloc": (True, "tracemalloc"),
+}
+
+def show_results_window(original, reconstructed, comp_rate, psnr, ssim, compress_time, decompress_time,
+                        stages=None, call_profile=""):
     window = tk.Toplevel()
     window.title("Compression Results")
-    window.geometry("600x570")
+    window.geometry("760x900" if stages else "600x570")
 
     frame = ttk.Frame(window)
     frame.pack(pady=10)
 
-    original_display = original_img.copy()
-    original_display.thumbnail((200, 200))
+    original_display = thumbnail_from_array(original)
     photo_orig = ImageTk.PhotoImage(original_display)
     orig_label = ttk.Label(frame, image=photo_orig)
     orig_label.image = photo_orig
     orig_label.grid(row=0, column=0, padx=10)
     ttk.Label(frame, text="Original").grid(row=1, column=0)
 
-    recon_display = reconstructed_img.copy()
-    recon_display.thumbnail((200, 200))
+    recon_display = thumbnail_from_array(reconstructed)
     photo_recon = ImageTk.PhotoImage(recon_display)
     recon_label = ttk.Label(frame, image=photo_recon)
     recon_label.image = photo_recon
@@ -83,12 +98,40 @@ def show_results_window(original_img, reconstructed_img, comp_rate, psnr, ssim,
     time_table.insert("", "end", values=("Total", f"{total_time:.0f}"))
     time_table.pack(pady=(0, 10))
 
+    if stages:
+        show_stage_table(window, stages, call_profile)
+
+# per-stage breakdown of a profiled job, stages nest so their times overlap
+def show_stage_table(window, stages, call_profile):
+    ttk.Label(window, text="Stages", font=("Segoe UI", 10, "bold")).pack(pady=(5, 0))
+    columns = ("Stage", "Calls", "Time (ms)", "Bytes in", "Bytes out", "Allocated blocks")
+    stage_table = ttk.Treeview(window, columns=columns, show="headings", height=min(len(stages), 8),
+                               bootstyle="info")
+    for column in columns:
+        stage_table.heading(column, text=column)
+        stage_table.column(column, anchor="center", width=200 if column == "Stage" else 100)
+    for row in stages:
+        stage_table.insert("", "end", values=(row["stage"], row["calls"], f"{row['ms']:.1f}", row["bytes_in"],
+                                              row["bytes_out"], row["allocated_blocks"]))
+    stage_table.pack(pady=(0, 10))
+
+    if call_profile:
+        text = tk.Text(window, height=12, wrap="none", font=("Consolas", 9))
+        text.insert("1.0", call_profile)
+        text.configure(state="disabled")
+        text.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
 def get_test_images():
-    image_extensions = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff', '*.pgm', '*.gif', '*webp')
-    image_files = []
-    for ext in image_extensions:
-        image_files.extend(glob.glob(f"test_images/{ext}"))
-    return [os.path.basename(path) for path in image_files]
+    return test_images_index.files()
+
+# refresh the picker when it opens, the index only rescans if test_images changed
+def refresh_test_images():
+    test_images_combo['values'] = get_test_images()
+
+def show_thumbnail(path):
+    photo = ImageTk.PhotoImage(thumbnail_cache.get(path))
+    image_label.config(image=photo)
+    image_label.image = photo
 
 def select_test_image(event=None):
     global selected_image_path, selected_test_image
@@ -96,26 +139,18 @@ def select_test_image(event=None):
     if filename:
         selected_test_image = filename
         selected_image_path = os.path.join("test_images", filename)
-        img = Image.open(selected_image_path)
-        img.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(img)
-        image_label.config(image=photo)
-        image_label.image = photo
+        show_thumbnail(selected_image_path)
         info_label.config(text=f"Selected image: {filename}")
 
 def open_image():
     global selected_image_path
     file_path = filedialog.askopenfilename(
         title="Select an image",
-        filetypes=[("Image files", "*.bmp *.png *.tiff *.jpg *.pgm")]
+        filetypes=[("Image files", "*.bmp *.png *.tiff *.jpg *.pgm *.jp2 *.j2k")]
     )
     if file_path:
         selected_image_path = file_path
-        img = Image.open(file_path)
-        img.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(img)
-        image_label.config(image=photo)
-        image_label.image = photo
+        show_thumbnail(file_path)
         info_label.config(text=f"Selected image: {os.path.basename(file_path)}")
         test_images_combo.set('')
 
@@ -127,55 +162,58 @@ def compress_image():
     if not algorithm:
         result_text.set("You haven't selected an algorithm.")
         return
-    try:
-        filename = os.path.splitext(os.path.basename(selected_image_path))[0]
-        compressed_path = f"results/{filename}_{algorithm.lower().replace(' ', '')}.bin"
-        reconstructed_path = f"results/{filename}_{algorithm.lower().replace(' ', '')}_reconstructed.png"
-        os.makedirs("results", exist_ok=True)
-
-        compress_start = time.time()
-
-        if algorithm == "Huffman":
-            huffman.compress(selected_image_path, compressed_path)
-            compress_end = time.time()
-            huffman.decompress(compressed_path, reconstructed_path)
-        elif algorithm == "LZW":
-            lzw.compress(selected_image_path, compressed_path)
-            compress_end = time.time()
-            lzw.decompress(compressed_path, reconstructed_path)
-        elif algorithm == "DEFLATE":
-            deflate.compress(selected_image_path, compressed_path)
-            compress_end = time.time()
-            deflate.decompress(compressed_path, reconstructed_path)
-        elif algorithm == "JPEG":
-            quality = selected_jpeg_quality.get()
-            jpeg.compress(selected_image_path, compressed_path, quality=quality)
-            compress_end = time.time()
-            jpeg.decompress(compressed_path, reconstructed_path)
-        elif algorithm == "JPEG 2000":
-            ratio = selected_compression_ratio.get()
-            jpeg2000.compress(selected_image_path, compressed_path, compression_ratio=ratio)
-            compress_end = time.time()
-            jpeg2000.decompress(compressed_path, reconstructed_path)
+    params = {}
+    if algorithm == "JPEG":
+        params["quality"] = selected_jpeg_quality.get()
+    elif algorithm == "JPEG 2000":
+        params["compression_ratio"] = selected_compression_ratio.get()
+    codec = AUTO if algorithm == AUTO else get_codec(algorithm, **params)
+
+    # the job only gets plain values, Tk variables must not be touched off the main thread
+    profile, capture = PROFILE_MODES[selected_profile_mode.get()]
+    job_queue.submit(Job(selected_image_path, codec, result_cache if use_cache.get() else None,
+                         profile=profile, capture=capture))
+    update_progress()
+
+def cancel_jobs():
+    if job_queue.active():
+        job_queue.cancel_all()
+        result_text.set("Cancelling, the current stage finishes first...")
+
+# progress line for the running job and the number of jobs waiting behind it
+def update_progress(job=None, stage=None):
+    active = job_queue.active()
+    if not active:
+        progress_bar["value"] = 0
+        progress_text.set("")
+        cancel_button.configure(state="disabled")
+        return
+    cancel_button.configure(state="normal")
+    waiting = f", {len(active) - 1} more queued" if len(active) > 1 else ""
+    if job is None:
+        progress_text.set(f"{active[0]}: waiting{waiting}")
+    else:
+        progress_bar["value"] = 100 * stage / len(STAGES)
+        progress_text.set(f"{job}: {STAGES[stage]} ({stage + 1}/{len(STAGES)}){waiting}")
+
+# handle worker events on the Tk thread, then poll again
+def poll_jobs():
+    for kind, job, value in job_queue.poll():
+        if kind == "progress":
+            update_progress(job, value)
+            continue
+        if kind == "done":
+            show_results_window(value["original"], value["reconstructed"], value["comp_rate"],
+                                value["psnr"], value["ssim"], value["compress_time"], value["decompress_time"],
+                                value.get("stages"), value.get("call_profile", ""))
+            source = "Loaded from the result cache" if value["cached"] else "Compression and analysis completed"
+            result_text.set(f"{source}: {job}.\nSee results in new window.")
+        elif kind == "cancelled":
+            result_text.set(f"Cancelled: {job}.")
         else:
-            result_text.set("This algorithm is not implemented yet.")
-            return
-
-        decompress_end = time.time()
-
-        compress_time = (compress_end - compress_start) * 1000
-        decompress_time = (decompress_end - compress_end) * 1000
-
-        original_img = Image.open(selected_image_path).convert("RGB")
-        reconstructed_img = Image.open(reconstructed_path).convert("RGB")
-        comp_rate = calculate_compression_rate(selected_image_path, compressed_path)
-        psnr = calculate_psnr(original_img, reconstructed_img)
-        ssim = calculate_ssim(original_img, reconstructed_img)
-
-        show_results_window(original_img, reconstructed_img, comp_rate, psnr, ssim, compress_time, decompress_time)
-        result_text.set("Compression and analysis completed.\nSee results in new window.")
-    except Exception as e:
-        result_text.set(f"Error: {e}")
+            result_text.set(f"Error: {value}")
+        update_progress()
+    app.after(POLL_MS, poll_jobs)
 
 app = ttk.Window(themename="flatly")
 app.title("Image Compression App")
@@ -184,6 +222,8 @@ app.geometry("900x700")
 selected_algorithm = tk.StringVar()
 selected_compression_ratio = tk.IntVar(value=10)
 selected_jpeg_quality = tk.IntVar(value=75)
+use_cache = tk.BooleanVar(value=True)
+selected_profile_mode = tk.StringVar(value="Off")
 
 main_frame = ttk.Frame(app, padding=20)
 main_frame.pack(fill="both", expand=True)
@@ -195,7 +235,7 @@ image_select_frame = ttk.Labelframe(top_frame, text="Select Image", padding=10)
 image_select_frame.pack(side="left", fill="both", expand=True, padx=10)
 
 ttk.Label(image_select_frame, text="Choose from test_images:").pack(anchor="w")
-test_images_combo = ttk.Combobox(image_select_frame, state="readonly")
+test_images_combo = ttk.Combobox(image_select_frame, state="readonly", postcommand=refresh_test_images)
 test_images_combo['values'] = get_test_images()
 test_images_combo.pack(fill="x")
 test_images_combo.bind("<<ComboboxSelected>>", select_test_image)
@@ -214,7 +254,7 @@ algorithm_frame.pack(side="right", fill="both", expand=True, padx=10)
 
 ttk.Label(algorithm_frame, text="Select an algorithm:").pack(anchor="w")
 algo_menu = ttk.Combobox(algorithm_frame, textvariable=selected_algorithm, state="readonly")
-algo_menu['values'] = ["Huffman", "LZW", "DEFLATE", "JPEG", "JPEG 2000"]
+algo_menu['values'] = [AUTO] + list(CODECS)
 algo_menu.pack(fill="x")
 
 ratio_label = ttk.Label(algorithm_frame, text="Compression Ratio (JPEG 2000 only):")
@@ -249,14 +289,32 @@ def on_algorithm_change(event=None):
         jpeg_quality_label.pack_forget()
         jpeg_quality_combo.pack_forget()
 
+ttk.Checkbutton(algorithm_frame, text="Reuse cached results", variable=use_cache,
+                bootstyle="round-toggle").pack(side="bottom", anchor="w", pady=(10, 0))
+profile_combo = ttk.Combobox(algorithm_frame, textvariable=selected_profile_mode, state="readonly")
+profile_combo['values'] = list(PROFILE_MODES)
+profile_combo.pack(side="bottom", fill="x")
+ttk.Label(algorithm_frame, text="Profiling:").pack(side="bottom", anchor="w", pady=(10, 0))
+
 selected_algorithm.trace_add('write', lambda *args: on_algorithm_change())
 
 bottom_frame = ttk.Frame(main_frame)
 bottom_frame.pack(fill="x", pady=20)
 
-ttk.Button(bottom_frame, text="Compress", command=compress_image, bootstyle="info outline", width=20).pack(pady=10)
+button_frame = ttk.Frame(bottom_frame)
+button_frame.pack(pady=10)
+ttk.Button(button_frame, text="Compress", command=compress_image, bootstyle="info outline", width=20).pack(side="left", padx=5)
+cancel_button = ttk.Button(button_frame, text="Cancel", command=cancel_jobs, bootstyle="danger outline", width=20,
+                           state="disabled")
+cancel_button.pack(side="left", padx=5)
+
+progress_bar = ttk.Progressbar(bottom_frame, maximum=100, bootstyle="info striped")
+progress_bar.pack(fill="x", padx=100)
+progress_text = tk.StringVar()
+ttk.Label(bottom_frame, textvariable=progress_text, bootstyle="secondary").pack()
 
 result_text = tk.StringVar()
 ttk.Label(bottom_frame, textvariable=result_text, wraplength=700, justify="left", bootstyle="info").pack(pady=10)
 
+app.after(POLL_MS, poll_jobs)
 app.mainloop()
@@ -1,25 +1,151 @@
 import math
 import numpy as np
 from PIL import Image
-from skimage.metrics import structural_similarity as compare_ssim
+
+# rows processed at a time, so temporaries stay a few MB on large images
+STRIP_ROWS = 256
+
+# SSIM constants, as in skimage.metrics.structural_similarity for uint8 data
+DATA_RANGE = 255.0
+SSIM_C1 = (0.01 * DATA_RANGE) ** 2
+SSIM_C2 = (0.03 * DATA_RANGE) ** 2
+BOX_SIZE = 7
+GAUSSIAN_SIGMA = 1.5
+
+METRICS = ["mse", "psnr", "ssim", "ssim_channels"]
 
 def calculate_compression_rate(original_path, compressed_path):
     import os
     original_size = os.path.getsize(original_path)
     compressed_size = os.path.getsize(compressed_path)
+    return compression_rate(original_size, compressed_size)
+
+def compression_rate(original_size, compressed_size):
     return original_size / compressed_size if compressed_size != 0 else 0
 
 def calculate_psnr(original_img, reconstructed_img):
-    original = np.array(original_img).astype(np.float64)
-    reconstructed = np.array(reconstructed_img).astype(np.float64)
-    mse = np.mean((original - reconstructed) ** 2)
+    return calculate_metrics(original_img, reconstructed_img, ["psnr"])["psnr"]
+
+def calculate_ssim(original_img, reconstructed_img):
+    return calculate_metrics(original_img, reconstructed_img, ["ssim"])["ssim"]
+
+# uint8 pixels of a PIL image or array, without copying arrays that already are
+def as_pixels(image):
+    pixels = np.asarray(image)
+    if pixels.dtype != np.uint8:
+        raise ValueError(f"Expected uint8 pixels, got {pixels.dtype}")
+    return pixels if pixels.ndim == 3 else pixels[:, :, np.newaxis]
+
+# 8-bit luma with the same integer rounding as PIL's convert("L") (ITU-R 601-2)
+def luma(pixels, strip_rows=STRIP_ROWS):
+    if pixels.shape[2] == 1:
+        return pixels[:, :, 0]
+    out = np.empty(pixels.shape[:2], dtype=np.uint8)
+    for start in range(0, pixels.shape[0], strip_rows):
+        strip = pixels[start:start + strip_rows].astype(np.uint32)
+        out[start:start + strip_rows] = (strip[:, :, 0] * 19595 + strip[:, :, 1] * 38470
+                                         + strip[:, :, 2] * 7471 + 0x8000) >> 16
+    return out
+
+# sum of squared differences, accumulated exactly in integers one strip at a time
+def squared_error(original, reconstructed, strip_rows=STRIP_ROWS):
+    total = 0
+    for start in range(0, original.shape[0], strip_rows):
+        diff = original[start:start + strip_rows].astype(np.int32) - reconstructed[start:start + strip_rows]
+        total += int(np.sum(diff * diff, dtype=np.int64))
+    return total
+
+def psnr_from_mse(mse):
     if mse == 0:
         return float('inf')
-    PIXEL_MAX = 255.0
-    return 20 * math.log10(PIXEL_MAX / math.sqrt(mse))
+    return 20 * math.log10(DATA_RANGE / math.sqrt(mse))
 
-def calculate_ssim(original_img, reconstructed_img):
-    original = np.array(original_img.convert('L'))
-    reconstructed = np.array(reconstructed_img.convert('L'))
-    ssim, _ = compare_ssim(original, reconstructed, full=True)
-    return ssim
+# 1-D SSIM window weights: a 7 tap box, or an 11 tap Gaussian (sigma 1.5, truncated at 3.5 sigma)
+def ssim_window(gaussian=False):
+    if not gaussian:
+        return np.full(BOX_SIZE, 1.0 / BOX_SIZE)
+    radius = int(3.5 * GAUSSIAN_SIGMA + 0.5)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-x * x / (2 * GAUSSIAN_SIGMA ** 2))
+    return weights / weights.sum()
+
+# separable filter over the windows that fit entirely inside the plane
+def filter_valid(plane, weights):
+    n = len(weights)
+    rows = plane.shape[0] - n + 1
+    cols = plane.shape[1] - n + 1
+    vertical = weights[0] * plane[:rows]
+    for k in range(1, n):
+        vertical += weights[k] * plane[k:k + rows]
+    out = weights[0] * vertical[:, :cols]
+    for k in range(1, n):
+        out += weights[k] * vertical[:, k:k + cols]
+    return out
+
+# mean SSIM of two uint8 planes, and the SSIM map if full is set
+# windows crossing the border are skipped, which is what skimage's cropped mean does,
+# so only a strip of window statistics is alive at any time
+def ssim_plane(x, y, gaussian=False, full=False, strip_rows=STRIP_ROWS):
+    weights = ssim_window(gaussian)
+    n = len(weights)
+    height, width = x.shape
+    if height < n or width < n:
+        raise ValueError(f"Image is smaller than the {n}x{n} SSIM window")
+    # sample covariance over the window, as skimage's default use_sample_covariance=True
+    cov_norm = n * n / (n * n - 1)
+    out_rows, out_cols = height - n + 1, width - n + 1
+    ssim_map = np.empty((out_rows, out_cols)) if full else None
+
+    total = 0.0
+    for start in range(0, out_rows, strip_rows):
+        end = min(start + strip_rows, out_rows)
+        xs = x[start:end + n - 1].astype(np.float64)
+        ys = y[start:end + n - 1].astype(np.float64)
+        ux = filter_valid(xs, weights)
+        uy = filter_valid(ys, weights)
+        vx = cov_norm * (filter_valid(xs * xs, weights) - ux * ux)
+        vy = cov_norm * (filter_valid(ys * ys, weights) - uy * uy)
+        vxy = cov_norm * (filter_valid(xs * ys, weights) - ux * uy)
+        s = ((2 * ux * uy + SSIM_C1) * (2 * vxy + SSIM_C2)) / ((ux * ux + uy * uy + SSIM_C1) * (vx + vy + SSIM_C2))
+        total += s.sum()
+        if full:
+            ssim_map[start:end] = s
+    return float(total / (out_rows * out_cols)), ssim_map
+
+# compute the requested metrics of two images (PIL images or (h, w[, c]) uint8 arrays) in one pass
+#   mse, psnr      over all channels, as calculate_psnr
+#   ssim           on the luma plane, as calculate_ssim
+#   ssim_channels  list with the SSIM of every channel
+# gaussian selects the 11 tap Gaussian window instead of the 7x7 box,
+# full adds "ssim_map" (the luma SSIM map of the fully inside windows) to the result
+# original_luma can pass luma(original) in when the same original is compared many times
+def calculate_metrics(original_img, reconstructed_img, metrics=("psnr", "ssim"), gaussian=False, full=False,
+                      strip_rows=STRIP_ROWS, original_luma=None):
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+    original = as_pixels(original_img)
+    reconstructed = as_pixels(reconstructed_img)
+    if original.shape != reconstructed.shape:
+        raise ValueError(f"Image shapes differ: {original.shape} and {reconstructed.shape}")
+
+    results = {}
+    if "mse" in metrics or "psnr" in metrics:
+        mse = squared_error(original, reconstructed, strip_rows) / max(original.size, 1)
+        if "mse" in metrics:
+            results["mse"] = mse
+        if "psnr" in metrics:
+            results["psnr"] = psnr_from_mse(mse)
+    if "ssim" in metrics or full:
+        if original_luma is None:
+            original_luma = luma(original, strip_rows)
+        ssim, ssim_map = ssim_plane(original_luma, luma(reconstructed, strip_rows),
+                                    gaussian, full, strip_rows)
+        if "ssim" in metrics:
+            results["ssim"] = ssim
+        if full:
+            results["ssim_map"] = ssim_map
+    if "ssim_channels" in metrics:
+        results["ssim_channels"] = [ssim_plane(original[:, :, c], reconstructed[:, :, c], gaussian, False, strip_rows)[0]
+                                    for c in range(original.shape[2])]
+    return results
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import numpy as np
+from PIL import Image
+
+# default location and size cap of the on-disk result cache
+CACHE_DIR = os.path.join("results", "cache")
+MAX_BYTES = 256 << 20
+
+# content hash of an image: shape, dtype and raw pixel bytes
+def pixels_digest(pixels):
+    pixels = np.ascontiguousarray(pixels)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{pixels.dtype.str}{pixels.shape}".encode())
+    digest.update(memoryview(pixels).cast("B"))
+    return digest.hexdigest()
+
+# cache key of one run: the pixel digest plus everything that can change the codec output
+def result_key(digest, codec):
+    description = {
+        "pixels": digest,
+        "codec": codec.name,
+        "params": codec.params,
+        "version": codec.version,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+# content-addressed store of compression results, one JSON record per key
+# plus an optional PNG of the reconstructed image
+# entries are touched on every hit, and the least recently used ones are evicted
+# once the directory grows past max_bytes
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def record_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def image_path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    # cached record for key, or None
+    # with image=True the record must come with its reconstructed image, returned as an array
+    def get(self, key, image=False):
+        try:
+            with open(self.record_path(key)) as f:
+                record = json.load(f)
+            if image:
+                with Image.open(self.image_path(key)) as reconstructed:
+                    record["reconstructed"] = np.asarray(reconstructed.convert("RGB"))
+        except (OSError, ValueError):
+            return None
+        self.touch(key)
+        return record
+
+    # store a JSON-serializable record, and the reconstructed (h, w, 3) array if given
+    def put(self, key, record, reconstructed=None):
+        os.makedirs(self.directory, exist_ok=True)
+        if reconstructed is not None:
+            temporary = self.image_path(key) + ".tmp"
+            Image.fromarray(reconstructed, "RGB").save(temporary, format="PNG")
+            os.replace(temporary, self.image_path(key))
+        temporary = self.record_path(key) + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(record, f)
+        os.replace(temporary, self.record_path(key))
+        self.evict()
+
+    # mark an entry as recently used
+    def touch(self, key):
+        for path in (self.record_path(key), self.image_path(key)):
+            if os.path.exists(path):
+                os.utime(path)
+
+    # delete least recently used files until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith((".json", ".png")):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith((".json", ".png", ".tmp")):
+                    os.remove(os.path.join(self.directory, name))
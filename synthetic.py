@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import math
+import argparse
+import textwrap
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from compressors.strips import write_ppm
+
+# synthetic test images of any size, generated one strip of rows at a time so even
+# 16k x 16k images never exist in memory as a whole
+#
+# an image is a stack of layers drawn bottom to top:
+#   gradient  smooth background between two random colours, in a random direction
+#   shapes    filled rectangles and ellipses with a black outline
+#   text      a paragraph rendered once and repeated over the image
+#   noise     independent symbols whose entropy per channel is set exactly; as the bottom layer
+#             it is the image, above other layers it is added to them as grain
+# contents name their layers joined by "+", "mix" is every layer at once
+
+# bumped whenever the same arguments start producing different pixels
+GENERATOR_VERSION = 1
+
+LAYERS = ["gradient", "shapes", "text", "noise"]
+CONTENTS = ["gradient", "shapes", "text", "noise", "mix"]
+MODES = ["RGB", "L"]
+MIN_SIZE = 64
+MAX_SIZE = 16384
+
+# rows generated at a time, part of the definition of the noise stream, so it never changes
+STRIP_ROWS = 64
+
+# shapes per 512 x 512 pixels and their side lengths, constant so the statistics per pixel
+# stay the same at every image size (as in the original 512 x 512 generator)
+SHAPES_PER_BLOCK = 20
+SHAPE_SIZE = (30, 150)
+
+# entropy of the grain noise in mixes, bits per channel
+MIX_NOISE_ENTROPY = 2.0
+
+TEXT = (
+    "The universe is the vast expanse of space and time that encompasses all matter, energy, planets, stars, "
+    "galaxies, and even the emptiness between them. It is unimaginably large and represents one of the greatest "
+    "mysteries humanity has ever sought to understand. Since the earliest days of civilization, humans have looked "
+    "up at the starry sky with awe and wonder, asking questions about what lies beyond. They have pondered how the "
+    "cosmos began and whether there is something even farther than what the eye can see. Current scientific "
+    "understanding suggests that the universe began approximately thirteen point eight billion years ago in an "
+    "event known as the Big Bang. At that moment, all space, time, matter, and energy were compressed into a "
+    "singular point of infinite density and temperature. Suddenly, this point began to expand rapidly, creating "
+    "space and time as we know them today."
+)
+TEXT_BLOCK_WIDTH = 512
+TEXT_LINE_HEIGHT = 18
+
+MANIFEST = "manifest.json"
+
+# layers of a content name, e.g. "gradient+shapes" or "mix"
+def content_layers(content):
+    layers = LAYERS if content == "mix" else content.split("+")
+    for layer in layers:
+        if layer not in LAYERS:
+            raise ValueError(f"Unknown layer: {layer}")
+    return layers
+
+# probabilities of 256 symbols, p_i proportional to exp(-beta * i), with the given Shannon entropy in bits
+# the entropy falls monotonically as beta grows, so beta is found by bisection
+def symbol_distribution(entropy):
+    if not 0 <= entropy <= 8:
+        raise ValueError(f"Entropy must be between 0 and 8 bits, got {entropy}")
+    symbols = np.arange(256)
+
+    def distribution(beta):
+        weights = np.exp(-beta * symbols)
+        return weights / weights.sum()
+
+    def bits(p):
+        p = p[p > 0]
+        return float(-(p * np.log2(p)).sum())
+
+    low, high = 0.0, 64.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if bits(distribution(middle)) > entropy:
+            low = middle
+        else:
+            high = middle
+    return distribution(high)
+
+# signed offsets 0, -1, 1, -2, 2, ... in order of decreasing probability
+ZIGZAG = np.array([(i + 1) // 2 * (-1 if i % 2 else 1) for i in range(256)], dtype=np.int16)
+
+class Generator:
+    def __init__(self, content, width, height, mode="RGB", seed=0, entropy=None):
+        if not (MIN_SIZE <= width <= MAX_SIZE and MIN_SIZE <= height <= MAX_SIZE):
+            raise ValueError(f"Sizes go from {MIN_SIZE} to {MAX_SIZE}, got {width}x{height}")
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        self.content = content
+        self.layers = content_layers(content)
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.channels = 3 if mode == "RGB" else 1
+        self.seed = seed
+        if "noise" in self.layers:
+            if entropy is None:
+                entropy = MIX_NOISE_ENTROPY if self.layers[0] != "noise" else 8.0
+            self.cdf = np.cumsum(symbol_distribution(entropy))
+        self.entropy = entropy
+
+        rng = np.random.default_rng([seed, GENERATOR_VERSION])
+        self.colors = rng.integers(0, 256, (2, self.channels))
+        self.direction = rng.uniform(0, 2 * math.pi)
+        self.shapes = self.place_shapes(rng) if "shapes" in self.layers else []
+        self.shape_tops = np.array([shape[1] for shape in self.shapes])
+        self.text = self.render_text() if "text" in self.layers else None
+
+    # (kind, top, bottom, left, right, colour) of every shape, sorted by top row
+    def place_shapes(self, rng):
+        count = max(1, round(SHAPES_PER_BLOCK * self.width * self.height / 512 ** 2))
+        low, high = SHAPE_SIZE
+        top = rng.integers(0, max(1, self.height - low), count)
+        left = rng.integers(0, max(1, self.width - low), count)
+        bottom = np.minimum(top + rng.integers(low, high + 1, count), self.height - 1)
+        right = np.minimum(left + rng.integers(low, high + 1, count), self.width - 1)
+        kinds = rng.integers(0, 2, count)
+        colors = rng.integers(0, 256, (count, self.channels))
+        order = np.argsort(top, kind="stable")
+        return [(("rectangle", "ellipse")[kinds[i]], top[i], bottom[i], left[i], right[i], colors[i]) for i in order]
+
+    # the paragraph wrapped into a block of TEXT_BLOCK_WIDTH pixels, as a boolean ink mask
+    @staticmethod
+    def render_text():
+        try:
+            font = ImageFont.truetype("arial.ttf", 14)
+        except IOError:
+            font = ImageFont.load_default()
+        lines = textwrap.wrap(TEXT, width=70)
+        block = Image.new("L", (TEXT_BLOCK_WIDTH, TEXT_LINE_HEIGHT * (len(lines) + 1)), color=255)
+        draw = ImageDraw.Draw(block)
+        for i, line in enumerate(lines):
+            x = (TEXT_BLOCK_WIDTH - draw.textlength(line, font=font)) // 2
+            draw.text((x, TEXT_LINE_HEIGHT // 2 + i * TEXT_LINE_HEIGHT), line, font=font, fill=0)
+        return np.asarray(block) < 128
+
+    def gradient(self, y0, y1):
+        ys = np.arange(y0, y1, dtype=np.float32)[:, np.newaxis]
+        xs = np.arange(self.width, dtype=np.float32)[np.newaxis, :]
+        dx, dy = math.cos(self.direction), math.sin(self.direction)
+        # position along the direction, 0 at one corner of the image and 1 at the opposite one
+        extent = abs(dx) * (self.width - 1) + abs(dy) * (self.height - 1)
+        origin = min(0, dx * (self.width - 1)) + min(0, dy * (self.height - 1))
+        t = ((xs * dx + ys * dy) - origin) / max(extent, 1)
+        start, end = self.colors.astype(np.float32)
+        return np.rint(start + t[:, :, np.newaxis] * (end - start)).astype(np.uint8)
+
+    def draw_shapes(self, strip, y0, y1):
+        # no shape is taller than SHAPE_SIZE[1], so only those starting a little above the strip can reach it
+        first, last = np.searchsorted(self.shape_tops, [y0 - SHAPE_SIZE[1], y1])
+        for kind, top, bottom, left, right, color in self.shapes[first:last]:
+            if bottom < y0:
+                continue
+            rows = np.arange(max(top, y0), min(bottom, y1 - 1) + 1)[:, np.newaxis]
+            columns = np.arange(left, right + 1)[np.newaxis, :]
+            if kind == "rectangle":
+                inside = np.ones((len(rows), right - left + 1), dtype=bool)
+                edge = (rows == top) | (rows == bottom) | (columns == left) | (columns == right)
+            else:
+                cy, cx = (top + bottom) / 2, (left + right) / 2
+                ry, rx = max((bottom - top) / 2, 0.5), max((right - left) / 2, 0.5)
+                inside = ((rows - cy) / ry) ** 2 + ((columns - cx) / rx) ** 2 <= 1
+                edge = inside & (((rows - cy) / max(ry - 1, 0.5)) ** 2 + ((columns - cx) / max(rx - 1, 0.5)) ** 2 > 1)
+            region = strip[rows[0, 0] - y0:rows[-1, 0] - y0 + 1, left:right + 1]
+            region[inside] = color
+            region[edge] = 0
+
+    def draw_text(self, strip, y0, y1):
+        block_height, block_width = self.text.shape
+        ink = self.text[np.arange(y0, y1)[:, np.newaxis] % block_height, np.arange(self.width)[np.newaxis, :] % block_width]
+        strip[ink] = 0
+
+    # noise offsets of one strip, from its own seed so strips can be made in any order
+    def noise(self, index, rows):
+        rng = np.random.default_rng([self.seed, GENERATOR_VERSION, index])
+        symbols = np.searchsorted(self.cdf, rng.random((rows, self.width, self.channels), dtype=np.float32), side="right")
+        return ZIGZAG[np.minimum(symbols, 255)]
+
+    # rows y0 to y1 as a (rows, width, channels) uint8 array, y0 a multiple of STRIP_ROWS
+    def strip(self, y0, y1):
+        strip = np.full((y1 - y0, self.width, self.channels), 255, dtype=np.uint8)
+        for position, layer in enumerate(self.layers):
+            if layer == "gradient":
+                strip[:] = self.gradient(y0, y1)
+            elif layer == "shapes":
+                self.draw_shapes(strip, y0, y1)
+            elif layer == "text":
+                self.draw_text(strip, y0, y1)
+            else:
+                base = 128 if position == 0 else strip.astype(np.int16)
+                strip[:] = np.clip(base + self.noise(y0 // STRIP_ROWS, y1 - y0), 0, 255)
+        return strip
+
+    def strips(self):
+        for y0 in range(0, self.height, STRIP_ROWS):
+            yield self.strip(y0, min(y0 + STRIP_ROWS, self.height))
+
+    # write the image to path, strip by strip for PPM/PGM and .npy files
+    def save(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in (".ppm", ".pgm"):
+            write_ppm(path, self.width, self.height, self.strips(), self.channels)
+        elif extension == ".npy":
+            shape = (self.height, self.width, 3) if self.channels == 3 else (self.height, self.width)
+            array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+            for y0, strip in zip(range(0, self.height, STRIP_ROWS), self.strips()):
+                array[y0:y0 + strip.shape[0]] = strip.reshape(array[y0:y0 + strip.shape[0]].shape)
+            array.flush()
+            del array
+        else:
+            pixels = np.concatenate(list(self.strips()))
+            Image.fromarray(pixels if self.channels == 3 else pixels[:, :, 0], self.mode).save(path)
+
+    def file_name(self, extension):
+        entropy = f"_e{self.entropy:g}" if self.entropy is not None else ""
+        return f"{self.content.replace('+', '-')}_{self.width}x{self.height}_{self.mode}_s{self.seed}{entropy}{extension}"
+
+    # manifest entry, everything needed to generate the same file again
+    def describe(self, path):
+        return {"file": os.path.basename(path), "content": self.content, "width": self.width, "height": self.height,
+                "mode": self.mode, "seed": self.seed, "entropy": self.entropy, "bytes": os.path.getsize(path),
+                "generator_version": GENERATOR_VERSION}
+
+# add or replace entries in the manifest of a directory
+def update_manifest(directory, entries):
+    path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = {entry["file"]: entry for entry in json.load(f)}
+    manifest.update({entry["file"]: entry for entry in entries})
+    with open(path + ".tmp", "w") as f:
+        json.dump(sorted(manifest.values(), key=lambda entry: entry["file"]), f, indent=2)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+
+# "512" or "1024x768" -> (width, height)
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic test images, streamed to disk in strips.")
+    parser.add_argument("--content", nargs="+", default=["mix"], metavar="CONTENT",
+                        help=f"{', '.join(CONTENTS)} or layers joined by '+', e.g. gradient+noise (default: mix)")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(512, 512)], metavar="SIZE",
+                        help=f"image sizes as N or WxH, from {MIN_SIZE} to {MAX_SIZE} (default: 512)")
+    parser.add_argument("--entropy", nargs="+", type=float, default=[None], metavar="BITS",
+                        help="entropy of the noise layer in bits per channel, 0 to 8 (default: 8 for plain noise, "
+                             f"{MIX_NOISE_ENTROPY:g} as grain)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["RGB"], help="RGB and/or L (grayscale)")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0], help="random seeds (default: 0)")
+    parser.add_argument("--format", default="ppm", help="file extension: ppm (pgm for grayscale) and npy are "
+                                                        "streamed, others (png, bmp, tiff, ...) built in memory")
+    parser.add_argument("--output", default="synthetic_images", help="output directory")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    entries = []
+    for content in args.content:
+        has_noise = "noise" in content_layers(content)
+        for (width, height) in args.sizes:
+            for mode in args.modes:
+                for seed in args.seeds:
+                    # entropy only makes a difference with a noise layer
+                    for entropy in args.entropy if has_noise else [None]:
+                        generator = Generator(content, width, height, mode, seed, entropy)
+                        extension = "." + args.format.lower().lstrip(".")
+                        if extension == ".ppm" and mode == "L":
+                            extension = ".pgm"
+                        path = os.path.join(args.output, generator.file_name(extension))
+                        generator.save(path)
+                        entries.append(generator.describe(path))
+                        print(f"Saved {path}", file=sys.stderr)
+    update_manifest(args.output, entries)
+
+if __name__ == "__main__":
+    main()
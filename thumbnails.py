@@ -0,0 +1,76 @@
+import os
+from collections import OrderedDict
+from PIL import Image
+
+from compressors import jpeg2000
+
+THUMBNAIL_SIZE = (200, 200)
+
+# modes Image.reduce and Tk's PhotoImage both handle, anything else is converted to RGB
+DISPLAY_MODES = ("L", "RGB", "RGBA")
+
+# decode a file straight to thumbnail size
+# JPEG and JPEG 2000 are scaled down by the decoder itself (draft, reduced resolution level),
+# other formats are box-reduced by an integer factor before the final resize
+def load_thumbnail(path, size=THUMBNAIL_SIZE):
+    with Image.open(path) as image:
+        if image.format == "JPEG2000":
+            return thumbnail_from_array(jpeg2000.read_preview(path, size), size)
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        if image.mode not in DISPLAY_MODES:
+            image = image.convert("RGB")
+        factor = min(image.width // size[0], image.height // size[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+        image.thumbnail(size)
+        image.load()
+        return image
+
+# thumbnail of an (h, w, 3) uint8 array that is already in memory
+# strided sampling down to about twice the target size avoids copying the full image
+def thumbnail_from_array(pixels, size=THUMBNAIL_SIZE):
+    step = max(1, min(pixels.shape[0] // (2 * size[1]), pixels.shape[1] // (2 * size[0])))
+    image = Image.fromarray(pixels[::step, ::step].copy(), "RGB")
+    image.thumbnail(size)
+    return image
+
+# least recently used cache of file thumbnails, keyed by path, size and modification time
+# so edited files are decoded again
+class ThumbnailCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, path, size=THUMBNAIL_SIZE):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, size)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        thumbnail = load_thumbnail(path, size)
+        self.entries[key] = thumbnail
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return thumbnail
+
+# image file names in a directory, rescanned only when the directory itself changes
+class DirectoryIndex:
+    def __init__(self, directory, extensions):
+        self.directory = directory
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.mtime = None
+        self.names = []
+
+    def files(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            self.mtime, self.names = None, []
+            return self.names
+        if mtime != self.mtime:
+            with os.scandir(self.directory) as it:
+                self.names = sorted(entry.name for entry in it
+                                    if entry.is_file() and entry.name.lower().endswith(self.extensions))
+            self.mtime = mtime
+        return self.names
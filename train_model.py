@@ -0,0 +1,68 @@
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+from benchmark import find_images
+from compressors import models, transforms
+from compressors.registry import get_codec
+
+# trains a shared Huffman table and zlib preset dictionary on a directory of similar images
+# and saves it as models/<id>.icm; the codecs then take model=<id>
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train a shared codebook model for Huffman and DEFLATE.")
+    parser.add_argument("--images", default="test_images", help="directory with the training images")
+    parser.add_argument("--output", default=models.MODEL_DIR, help="directory the model is saved to")
+    parser.add_argument("--color-transform", choices=transforms.COLOR_TRANSFORMS, default="ycocg-r",
+                        help="color transform the images will be encoded with (default: ycocg-r)")
+    parser.add_argument("--predictor", choices=transforms.PREDICTORS, default="med",
+                        help="predictor the images will be encoded with (default: med); the shared Huffman "
+                             "tables only pay off on prediction residuals")
+    parser.add_argument("--dict-size", type=int, default=models.MAX_DICT_SIZE,
+                        help=f"preset dictionary size in bytes, at most {models.MAX_DICT_SIZE}")
+    parser.add_argument("--test-images", help="directory to compare encoded sizes with and without the model on")
+    return parser.parse_args(argv)
+
+# encoded sizes and times of every image with per-tile tables and with the model (a Model)
+def compare(model, paths, color_transform, predictor):
+    print(f"{'codec':<10}{'bytes':>12}{'with model':>12}{'change':>9}{'ms':>9}{'with model':>12}")
+    images = [np.asarray(Image.open(path).convert("RGB")) for path in paths]
+    for name in ("Huffman", "DEFLATE"):
+        totals = []
+        for codec in (get_codec(name, color_transform=color_transform, predictor=predictor),
+                      get_codec(name, color_transform=color_transform, predictor=predictor, model=model)):
+            size = 0
+            start = time.perf_counter()
+            for pixels in images:
+                data = codec.encode(pixels)
+                if not np.array_equal(codec.decode(data), pixels):
+                    sys.exit(f"{codec!r} did not round-trip")
+                size += len(data)
+            totals.append((size, (time.perf_counter() - start) * 1000))
+        (plain, plain_ms), (shared, shared_ms) = totals
+        print(f"{name:<10}{plain:>12}{shared:>12}{shared / plain - 1:>+9.1%}{plain_ms:>9.0f}{shared_ms:>12.0f}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.predictor == "none":
+        print("Warning: without a predictor tiles rarely use the shared Huffman tables, "
+              "only the DEFLATE dictionary is likely to help", file=sys.stderr)
+    paths = find_images(args.images)
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+    model = models.train((np.asarray(Image.open(path).convert("RGB")) for path in paths),
+                         args.color_transform, args.predictor, args.dict_size)
+    path = models.save(model, args.output)
+    print(f"Trained on {len(paths)} images, {model.describe()}")
+    print(f"Saved {path}")
+
+    if args.test_images:
+        test_paths = find_images(args.test_images)
+        if not test_paths:
+            sys.exit(f"No images found in {args.test_images}")
+        compare(model, test_paths, args.color_transform, args.predictor)
+
+if __name__ == "__main__":
+    main()